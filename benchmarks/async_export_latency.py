@@ -0,0 +1,122 @@
+"""
+Event loop lag while exporting with `TrackingService.aexport_<typename>`.
+
+A ticker task sleeps 1ms in a loop on the same event loop and records how
+late it wakes up, first on an idle loop and then while exporting documents
+to a local stub `_bulk` server through `AsyncBulkExportBackend`, with the
+default synchronous backends (the logging backend, writing to /dev/null,
+and the sync dispatcher) also configured.
+
+    python benchmarks/async_export_latency.py [--events 20000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from elastic_mapper import config, exporters, mappers, parsers, templates  # noqa: E402
+from elastic_mapper.async_exporters import AsyncBulkExportBackend  # noqa: E402
+from elastic_mapper.services import TrackingService  # noqa: E402
+
+TICK = 0.001
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers['Content-Length'])).splitlines()
+        items = [{'index': {'status': 201}} for _ in lines[::2]]
+        response = json.dumps({'errors': False, 'items': items}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class BenchmarkTemplate(templates.Template):
+    name = 'benchmark_template'
+    index = 'benchmark-{time}'
+    parser = parsers.YearlyParser()
+
+
+@templates.register('benchmark_type', BenchmarkTemplate)
+class BenchmarkMapper(mappers.Mapper):
+    string_field = mappers.StringField()
+    int_field = mappers.IntegerField()
+
+
+async def tick(lags, stopped):
+    while not stopped.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def measure(export, events):
+    lags = []
+    stopped = asyncio.Event()
+    ticker = asyncio.ensure_future(tick(lags, stopped))
+    start = time.perf_counter()
+    await export(events)
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    await ticker
+    return lags, elapsed
+
+
+async def idle(events):
+    await asyncio.sleep(events / 20000.0)
+
+
+async def export(events):
+    for i in range(events):
+        await TrackingService.aexport_benchmark_type({'string_field': 'value', 'int_field': i})
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000)
+    args = parser.parse_args()
+
+    exporters.handler.setStream(open(os.devnull, 'w'))
+    server = Server(('127.0.0.1', 0), BulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conf = config.Config()
+    conf.add_async_export_backend(AsyncBulkExportBackend, port=server.server_port)
+    backend = conf.async_export_backends[0]
+
+    loop = asyncio.new_event_loop()
+    try:
+        for name, run in (('idle loop', idle), ('exporting', export)):
+            lags, elapsed = loop.run_until_complete(measure(run, args.events))
+            print('%-10s lag p50 %.2fms  p99 %.2fms  max %.2fms' % (
+                name, percentile(lags, 0.5), percentile(lags, 0.99), percentile(lags, 1)))
+        print('exported %d events at %.0f events/s' % (args.events, args.events / elapsed))
+        loop.run_until_complete(backend.aclose())
+    finally:
+        loop.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
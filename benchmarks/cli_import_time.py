@@ -0,0 +1,52 @@
+"""
+Import time of the `elasticmapper` CLI module.
+
+Imports the CLI module in a fresh interpreter `--runs` times and reports the
+median import time, and whether the heavy dependencies that only some
+commands need (elasticsearch, pygments, tabulate, multiprocessing) were
+loaded by the import.
+
+    python benchmarks/cli_import_time.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CLI_DIR = os.path.join(ROOT, 'elastic_mapper', 'cli')
+HEAVY_MODULES = ('elasticsearch', 'pygments', 'tabulate', 'multiprocessing')
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import elasticmapper
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed,
+                  'loaded': [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES, )
+
+
+def run_once():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([CLI_DIR, ROOT])
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    run_once()  # warm the file and bytecode caches
+    results = [run_once() for _ in range(args.runs)]
+    times = sorted(result['elapsed'] for result in results)
+    print('import elasticmapper  median %.1fms  min %.1fms  (%d runs)' % (
+        times[len(times) // 2] * 1000, times[0] * 1000, args.runs))
+    print('heavy modules loaded: %s' % (', '.join(results[-1]['loaded']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Type conflict detection across timely indices with `TimelyIndexDiffer`.
+
+Builds a cluster of daily indices sharing one type with `--fields` fields,
+where one field is mapped with a different type in a single index, and times
+`TimelyIndexDiffer._compute_index_conflicts` for each number of indices. The
+pairwise comparison it replaced (one `MappingDiffer` per pair of indices) is
+timed too, unless `--skip-pairwise` is given.
+
+    python benchmarks/index_conflicts.py [--indices 30 90 365] [--fields 20]
+"""
+import argparse
+import collections
+import datetime
+import os
+import sys
+import time
+
+import six
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from elastic_mapper.cli.differs import (  # noqa: E402
+    IndexIssue, MappingDiffer, State, TimelyIndexDiffer)
+
+TYPENAME = 'bench_type'
+INDEX_PATTERN = 'bench-{time}'
+
+
+def build_mappings(indices, fields):
+    all_mappings = {}
+    day = datetime.date(2016, 1, 1)
+    for i in range(indices):
+        properties = dict(('field_%d' % j, {'type': 'long'}) for j in range(fields))
+        properties['object_field'] = {'properties': {'nested_field': {'type': 'keyword'}}}
+        if i == indices // 2:
+            properties['field_0'] = {'type': 'keyword'}
+        name = 'bench-' + (day + datetime.timedelta(days=i)).strftime('%Y%m%d')
+        all_mappings[name] = {'mappings': {TYPENAME: {'properties': properties}}}
+    return all_mappings
+
+
+def pairwise_index_conflicts(dest):
+    """The quadratic implementation, compare every pair of indices."""
+    index_conflicts = collections.OrderedDict()
+    items = list(six.iteritems(dest))
+    for i, (index_1, type_mappings_1) in enumerate(items):
+        for index_2, type_mappings_2 in items[i + 1:]:
+            common_types = set(type_mappings_1.keys()) & set(type_mappings_2.keys())
+            for typename in common_types:
+                index_differ = MappingDiffer(typename,
+                                             type_mappings_1[typename]['properties'],
+                                             type_mappings_2[typename]['properties'])
+                for fieldname, states in six.iteritems(index_differ.diff()):
+                    type_conflicts = [state for state in states
+                                      if state.state == State.type_conflict]
+                    if type_conflicts:
+                        if fieldname not in index_conflicts:
+                            index_conflicts[fieldname] = [IndexIssue(fieldname=fieldname), ]
+                        index_conflicts[fieldname][0].defined_types.add(
+                            type_conflicts[0].source_type)
+                        index_conflicts[fieldname][0].defined_types.add(
+                            type_conflicts[0].dest_type)
+    return index_conflicts
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--indices', type=int, nargs='+', default=[30, 90, 365])
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--skip-pairwise', action='store_true')
+    args = parser.parse_args()
+
+    for indices in args.indices:
+        all_mappings = build_mappings(indices, args.fields)
+        differ = TimelyIndexDiffer('bench_template', {}, INDEX_PATTERN, all_mappings)
+        assert len(differ.dest) == indices
+
+        conflicts, elapsed = timed(differ._compute_index_conflicts)
+        assert conflicts['field_0'][0].defined_types == {'long', 'keyword'}
+        line = '%4d indices  inverted index %8.1fms' % (indices, elapsed)
+        if not args.skip_pairwise:
+            pairwise, elapsed = timed(pairwise_index_conflicts, differ.dest)
+            assert pairwise['field_0'][0].defined_types == {'long', 'keyword'}
+            line += '  pairwise %8.1fms' % elapsed
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Batch mapping with `Mapper.map_many` against one mapper per object.
+
+Maps the same objects through the README example mapper (source, method and
+nested fields), first building `Mapper(obj).mapped_data` for every object and
+then with a single `Mapper.map_many(objects)` call. Each run is repeated and
+the best time is reported.
+
+    python benchmarks/map_many.py [--objects 100000] [--repeat 3] [--compiled]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from elastic_mapper import config, mappers  # noqa: E402
+
+
+class Nested(object):
+
+    def __init__(self, i):
+        self.nested_string = 'nested'
+        self.nested_int_field = i
+
+
+class Document(object):
+
+    def __init__(self, i):
+        self.string_field = 'value'
+        self.int_field = i
+        self.another_attr = 'another value'
+        self.nested_field = Nested(i)
+
+
+class NestedMapper(mappers.Mapper):
+    nested_string = mappers.StringField()
+    nested_int_with_source = mappers.IntegerField(source='nested_int_field')
+
+
+class BenchmarkMapper(mappers.Mapper):
+    string_field = mappers.StringField()
+    int_field = mappers.IntegerField()
+    string_field_with_source = mappers.StringField(source='another_attr')
+    method_field = mappers.StringField(method='get_test_method_field')
+    nested_field = NestedMapper()
+
+    def get_test_method_field(self, obj):
+        return 'test method string'
+
+
+def per_object(objects):
+    return [BenchmarkMapper(obj).mapped_data for obj in objects]
+
+
+def batch(objects):
+    return list(BenchmarkMapper.map_many(objects))
+
+
+def best_time(run, objects, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(objects)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--compiled', action='store_true',
+                        help='use compiled mappers (Config.compiled_mappers)')
+    args = parser.parse_args()
+
+    config.Config().compiled_mappers = args.compiled
+    objects = [Document(i) for i in range(args.objects)]
+    assert per_object(objects[:10]) == batch(objects[:10])
+
+    for name, run in (('Mapper(obj).mapped_data', per_object), ('Mapper.map_many', batch)):
+        elapsed = best_time(run, objects, args.repeat)
+        print('%-24s %.2fs  (%.1fus/object)' % (name, elapsed, elapsed / args.objects * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+asyncio export path (Python 3.7+).
+
+Async backends run on the caller's event loop, without threads. They are
+configured with `Config.add_async_export_backend` and used by
+`export_async` and the `TrackingService.aexport_<typename>` entry points.
+Synchronous backends are dispatched from the loop's default executor.
+"""
+import asyncio
+import logging
+import time
+from abc import ABCMeta, abstractmethod
+
+from elastic_mapper import config
+from elastic_mapper.exporters import (
+    BULK_LINES,
+    MAPPER,
+    BulkResult,
+    ExportEnvelope,
+    is_socket_dropped,
+    parse_bulk_response,
+    report_failed_batch,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncExportBackend(metaclass=ABCMeta):
+    # form of the document read from the export envelope (see `ExportEnvelope`)
+    consumes = MAPPER
+
+    @abstractmethod
+    async def export(self, mapper):
+        pass
+
+    async def export_envelope(self, envelope):
+        "Export a document from an envelope shared with the other backends"
+        await self.export(envelope.mapper)
+
+    async def aclose(self):
+        "Flush any buffered documents and release the backend resources"
+        pass
+
+
+async def export_async(mapper):
+    """
+    Send the mapped data to the configured async export backends.
+
+    Synchronous backends, if any, are handed over to the configured dispatcher
+    on the default executor, so their blocking I/O does not run on the loop.
+    Events dropped by the type sampler (see `samplers`) are not mapped.
+    """
+    sampler = mapper._meta.sampler
+    if sampler is not None and not sampler.allow(mapper.instance):
+        return
+    conf = config.Config()
+    envelope = ExportEnvelope(mapper)
+    exports = [backend.export_envelope(envelope) for backend in conf.async_export_backends]
+    if conf.export_backends:
+        loop = asyncio.get_running_loop()
+        exports.append(loop.run_in_executor(None, conf.dispatcher.dispatch_envelope, envelope))
+
+    try:
+        results = await asyncio.gather(*exports, return_exceptions=True)
+    finally:
+        envelope.close()
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(result, exc_info=(type(result), result, result.__traceback__))
+
+
+class _HTTPConnectionPool(object):
+    """
+    Minimal keep-alive HTTP/1.1 client on top of asyncio streams.
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._idle = []
+
+    async def _get_connection(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if (not reader.at_eof() and not writer.is_closing() and
+                    not is_socket_dropped(writer.get_extra_info('socket'))):
+                return reader, writer, True
+            # closed by the server while idle
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    async def request(self, method, path, body, headers):
+        reader, writer, reused = await self._get_connection()
+        try:
+            try:
+                await asyncio.wait_for(
+                    self._send_request(writer, method, path, body, headers), self.timeout)
+            except asyncio.TimeoutError:
+                raise
+            except (ConnectionError, OSError):
+                if not reused:
+                    raise
+                # the kept-alive connection failed while sending the request,
+                # before Elasticsearch could process it, so send it on a new one
+                writer.close()
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                await asyncio.wait_for(
+                    self._send_request(writer, method, path, body, headers), self.timeout)
+            # never retried once sent, Elasticsearch may have indexed the batch
+            status, data, keep_alive = await asyncio.wait_for(self._read_response(reader),
+                                                              self.timeout)
+        except Exception:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, data
+
+    async def _send_request(self, writer, method, path, body, headers):
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: %s:%s' % (self.host, self.port),
+                 'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % header for header in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _read_response(self, reader):
+        status = int((await reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b''.join(chunks)
+        else:
+            data = await reader.readexactly(int(response_headers.get('content-length', 0)))
+
+        keep_alive = response_headers.get('connection', '').lower() != 'close'
+        return status, data, keep_alive
+
+    def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+class AsyncBulkExportBackend(AsyncExportBackend):
+    """
+    Index documents in Elasticsearch using the `_bulk` API from an event loop.
+
+    Documents are buffered and sent when `max_docs`, `max_bytes` or
+    `max_latency` is reached (see `exporters.BulkExportBackend`). Batches are
+    sent as background tasks over pooled keep-alive connections, with at most
+    `max_concurrency` requests in flight; `export` only waits when that
+    limit is reached.
+    """
+    consumes = BULK_LINES
+
+    def __init__(self, host='localhost', port=9200, max_docs=500, max_bytes=5 * 1024 * 1024,
+                 max_latency=1.0, max_concurrency=4, timeout=10, on_failure=None):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.max_concurrency = max_concurrency
+        self.on_failure = on_failure
+
+        self._pool = _HTTPConnectionPool(host, port, timeout)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffered_at = None
+        self._latency_handle = None
+        self._semaphore = None
+        self._tasks = set()
+
+    async def export(self, mapper):
+        envelope = ExportEnvelope(mapper)
+        try:
+            await self.export_envelope(envelope)
+        finally:
+            envelope.close()
+
+    async def export_envelope(self, envelope):
+        lines = envelope.get(self.consumes)
+        if not self._buffer:
+            self._buffered_at = time.time()
+            if self.max_latency:
+                loop = asyncio.get_running_loop()
+                self._latency_handle = loop.call_later(self.max_latency, self._flush_later)
+        self._buffer.append(lines)
+        self._buffer_bytes += len(lines)
+
+        if len(self._buffer) >= self.max_docs or self._buffer_bytes >= self.max_bytes:
+            await self._send_buffer()
+
+    def _flush_later(self):
+        self._latency_handle = None
+        if self._buffer:
+            self._spawn(self._take_buffer())
+
+    def _take_buffer(self):
+        if self._latency_handle is not None:
+            self._latency_handle.cancel()
+            self._latency_handle = None
+        body = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffered_at = None
+        return body
+
+    async def _send_buffer(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # apply backpressure only when too many batches are in flight
+        await self._semaphore.acquire()
+        self._spawn(self._take_buffer(), acquired=True)
+
+    def _spawn(self, body, acquired=False):
+        task = asyncio.ensure_future(self._send(body, acquired))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, body, acquired=False):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if not acquired:
+            await self._semaphore.acquire()
+        try:
+            status, data = await self._pool.request('POST', '/_bulk', body,
+                                                    {'Content-Type': 'application/x-ndjson'})
+            return parse_bulk_response(status, data, self.on_failure)
+        except Exception as e:
+            report_failed_batch(body, e, self.on_failure)
+            raise
+        finally:
+            self._semaphore.release()
+
+    async def flush(self):
+        """
+        Send the buffered documents and wait for all the in-flight batches.
+
+        Returns a `BulkResult` aggregating the batches that were awaited.
+        """
+        if self._buffer:
+            self._spawn(self._take_buffer())
+
+        indexed = 0
+        failures = []
+        if self._tasks:
+            results = await asyncio.gather(*list(self._tasks), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BulkResult):
+                    indexed += result.indexed
+                    failures.extend(result.failures)
+        return BulkResult(indexed=indexed, failures=failures)
+
+    async def aclose(self):
+        await self.flush()
+        self._pool.close()
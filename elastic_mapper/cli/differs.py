@@ -1,11 +1,10 @@
 import collections
+import hashlib
+import json
 from enum import Enum
 
-import re
-
 from elastic_mapper import parsers
-
-from deepdiff import DeepDiff
+from elastic_mapper.frozen_mappings import FrozenMapping, canonical_json
 
 import six
 
@@ -24,6 +23,12 @@ class State(Enum):
     index_type_conflict = 11
 
 
+class SyncState(Enum):
+    changed = 1
+    unchanged = 2
+    failed = 3
+
+
 class MappingState(object):
     texts = {
         State.ok: ('OK', ''),
@@ -85,7 +90,7 @@ class IndexIssue(MappingState):
     def description(self):
         text = self.texts[self.state][1]
         return text.format(fieldname=self.fieldname,
-                           defined_types=','.join(self.defined_types))
+                           defined_types=','.join(sorted(self.defined_types)))
 
 
 class MappingIssue(MappingState):
@@ -105,21 +110,14 @@ class MappingIssue(MappingState):
                                                   '`{dest_param}` in the mapper')),
     }
 
-    def __init__(self, issue_type, diff, source, dest, change=None):
-        self.diff = diff
-        self.chain = self._parse_chain(diff)
+    def __init__(self, issue_type, chain, source, dest, change=None):
+        self.chain = list(chain)
         self.source = source
         self.dest = dest
         self.change = change
         self.fieldname = self._parse_fieldname(self.chain)
         self._set_state(issue_type)
 
-    def _parse_chain(self, diff):
-        pattern = re.compile(r"(?<=\[)(.*?)(?=\])")
-        matches = pattern.findall(diff)
-        matches = [m.replace("'", "") for m in matches]
-        return matches
-
     def _parse_fieldname(self, chain):
         return '.'.join(chain[::2])
 
@@ -157,17 +155,94 @@ class MappingIssue(MappingState):
         return node
 
 
+_interned = {}
+
+
+def intern_text(text):
+    "Return a shared instance of `text`, so repeated field names and types are stored once"
+    return _interned.setdefault(text, text)
+
+
 def normalize_mapping(mapping):
-    "Converts all string-like values of a mapping into the same text type"
+    """
+    Converts all string-like values of a mapping into the same (interned) text type.
+
+    Returns a `FrozenMapping`, shared by all the differs of a run (e.g. the
+    cluster mappings of a `snapshots.ClusterSnapshot`); frozen mappings are
+    returned as is.
+    """
+    if isinstance(mapping, FrozenMapping):
+        return mapping
     normalized = {}
     for k, v in six.iteritems(mapping):
+        if isinstance(k, six.string_types):
+            k = intern_text(six.text_type(k))
         if isinstance(v, dict):
             normalized[k] = normalize_mapping(v)
         elif isinstance(v, six.string_types):
-            normalized[k] = six.text_type(v)
+            normalized[k] = intern_text(six.text_type(v))
         else:
             normalized[k] = v
-    return normalized
+    return FrozenMapping(normalized)
+
+
+def gen_mapping_fields(mapping, prefix=''):
+    """
+    Generate `(fieldname, attrs)` for the leaf fields of a mapping.
+
+    Fields of nested objects are named with their full path (e.g. `obj.sub`).
+    """
+    new_prefix = (prefix + '.') if prefix else ''
+    for fieldname, attrs in six.iteritems(mapping):
+        if 'properties' in attrs:
+            # nested object
+            for field in gen_mapping_fields(attrs['properties'], new_prefix + fieldname):
+                yield field
+        else:
+            yield new_prefix + fieldname, attrs
+
+
+def freeze_mapping(value):
+    "Convert a mapping into a hashable value, so equal mappings have equal hashes"
+    if isinstance(value, dict):
+        return frozenset((k, freeze_mapping(v)) for k, v in six.iteritems(value))
+    if isinstance(value, list):
+        return tuple(freeze_mapping(v) for v in value)
+    return value
+
+
+def _equal_ignoring_order(source, dest):
+    if isinstance(source, list) and isinstance(dest, list):
+        return (collections.Counter(freeze_mapping(v) for v in source) ==
+                collections.Counter(freeze_mapping(v) for v in dest))
+    return source == dest
+
+
+def diff_mappings(source, dest, chain=()):
+    """
+    Walk two mappings and generate their differences as `(issue_type, chain, change)`.
+
+    `issue_type` is `added` for keys only in `dest`, `removed` for keys only in
+    `source` and `changed` for different values, with `change` holding the
+    `old_value` (source) and `new_value` (dest). `chain` is the tuple of keys
+    leading to the difference (e.g. `('obj', 'properties', 'sub', 'type')`).
+    Lists are compared ignoring their order.
+    """
+    for key, source_value in six.iteritems(source):
+        key_chain = chain + (key, )
+        if key not in dest:
+            yield 'removed', key_chain, None
+            continue
+        dest_value = dest[key]
+        if isinstance(source_value, dict) and isinstance(dest_value, dict):
+            for difference in diff_mappings(source_value, dest_value, key_chain):
+                yield difference
+        elif not _equal_ignoring_order(source_value, dest_value):
+            yield 'changed', key_chain, {'old_value': source_value, 'new_value': dest_value}
+
+    for key in dest:
+        if key not in source:
+            yield 'added', chain + (key, ), None
 
 
 class MappingDiffer(object):
@@ -177,35 +252,31 @@ class MappingDiffer(object):
         self.source = normalize_mapping(source)  # mapping generated by a mapper
         self.dest = normalize_mapping(dest)  # mapping present in ES
 
-        self.diff()
-
     def diff(self):
-        diff = DeepDiff(self.source,
-                        self.dest,
-                        ignore_order=True)
-
         states = {}
-        fieldnames = [f for f in self._gen_mapping_fieldnames(self.source)]
+        fieldnames = set(fieldname for fieldname, _ in gen_mapping_fields(self.source))
         for fieldname in sorted(fieldnames):
             states[fieldname] = []
 
-        for chain in diff.get('dictionary_item_added', []):
+        issues = collections.defaultdict(list)
+        for issue_type, chain, change in diff_mappings(self.source, self.dest):
+            issues[issue_type].append(MappingIssue(issue_type, chain, self.source, self.dest,
+                                                   change))
+
+        for issue in issues['added']:
             # fields -> dynamic fields (fields present in ES but not in the mapper)
             # params -> params present in ES but not in the mapper
-            issue = MappingIssue('added', chain, self.source, self.dest)
             states[issue.fieldname] = [issue]
 
-        for chain in diff.get('dictionary_item_removed', []):
+        for issue in issues['removed']:
             # fields -> new fields added to the mapper, no data with the new field sent to ES yet
             # params -> params newly added or declared in mapper but not sent to ES yet
-            issue = MappingIssue('removed', chain, self.source, self.dest)
             if issue.fieldname in fieldnames:
                 states[issue.fieldname].append(issue)
 
-        for chain, change in diff.get('values_changed', diff.get('type_changes', {})).items():
+        for issue in issues['changed']:
             # type -> type conflicts (a type declared in mapper while a different one exists in ES)
             # params -> params modified in mapper but not sent to ES yet
-            issue = MappingIssue('changed', chain, self.source, self.dest, change)
             if issue.fieldname in fieldnames:
                 states[issue.fieldname].append(issue)
 
@@ -238,32 +309,20 @@ class MappingDiffer(object):
         #     normalized[state.fieldname] = state
         return normalized
 
-    def _gen_mapping_fieldnames(self, mapping, prefix=''):
-        fieldnames = []
-        new_prefix = (prefix + '.') if prefix else ''
-        for fieldname, attrs in six.iteritems(mapping):
-            if 'properties' in attrs.keys():
-                # nested object
-                nested_fieldnames = self._gen_mapping_fieldnames(attrs['properties'],
-                                                                 new_prefix + fieldname)
-                for nf in nested_fieldnames:
-                    fieldnames.append(nf)
-            else:
-                fieldnames.append(new_prefix + fieldname)
-        return fieldnames
-
 
 class TimelyIndexDiffer(object):
 
-    def __init__(self, template_name, source, index_pattern, all_mappings):
+    def __init__(self, template_name, source, index_pattern, all_mappings, catalog=None):
         self.template_name = template_name
         self.source = normalize_mapping(source)  # mapping generated by a mapper
-        self.dest = normalize_mapping(self._filter_matching_mappings(index_pattern, all_mappings))
-
-        self.diff()
-
-    def _filter_matching_mappings(self, index_pattern, all_mappings):
-        matches = parsers.get_matching_indexes(index_pattern, all_mappings)
+        # `catalog` is the `parsers.IndexCatalog` of `all_mappings`, shared by many differs
+        catalog = catalog or parsers.IndexCatalog(all_mappings)
+        self.dest = normalize_mapping(self._filter_matching_mappings(index_pattern, all_mappings,
+                                                                     catalog))
+
+    def _filter_matching_mappings(self, index_pattern, all_mappings, catalog):
+        # only the top-level dict is built, the mappings of a normalized snapshot are reused
+        matches = catalog.match(index_pattern)
         dest = dict()
         for match in matches:
             dest[match] = all_mappings[match]['mappings']
@@ -288,35 +347,34 @@ class TimelyIndexDiffer(object):
         return states
 
     def _compute_index_conflicts(self):
-        """Compute type conflicts among timely indices in ES."""
+        """
+        Compute type conflicts among timely indices in ES.
+
+        Builds a single `(typename, fieldname) -> {type: [indices]}` inverted index
+        over all the matching indices, so the cost is linear in the number of indices.
+        """
+        field_types = collections.OrderedDict()
+        for index_name, type_mappings in six.iteritems(self.dest):
+            for typename, mapping in six.iteritems(type_mappings):
+                for fieldname, attrs in gen_mapping_fields(mapping['properties']):
+                    if 'type' not in attrs:
+                        continue
+                    types = field_types.setdefault((typename, fieldname),
+                                                   collections.OrderedDict())
+                    types.setdefault(attrs['type'], []).append(index_name)
+
         index_conflicts = collections.OrderedDict()
-        for i, (index_1, type_mappings_1) in enumerate(six.iteritems(self.dest)):
-            for j, (index_2, type_mappings_2) in enumerate(six.iteritems(self.dest)):
-                # go through all index combinations to check for conflicts (symmetric matrix)
-                if (i != j and j > i):
-                    common_types = set(type_mappings_1.keys()) & set(type_mappings_2.keys())
-                    for typename in common_types:
-                        index_differ = MappingDiffer(typename,
-                                                     type_mappings_1[typename]['properties'],
-                                                     type_mappings_2[typename]['properties'])
-                        index_states = index_differ.diff()
-                        for fieldname, states in six.iteritems(index_states):
-                            type_conflicts = [state for state in states
-                                              if state.state == State.type_conflict]
-                            if type_conflicts:
-                                if fieldname not in index_conflicts:
-                                    issue = IndexIssue(fieldname=fieldname)
-                                    index_conflicts[fieldname] = [issue, ]
-
-                                index_conflicts[fieldname][0].defined_types.add(type_conflicts[0].source_type)  # noqa
-                                index_conflicts[fieldname][0].defined_types.add(type_conflicts[0].dest_type)  # noqa
+        for (typename, fieldname), types in six.iteritems(field_types):
+            if len(types) > 1:
+                if fieldname not in index_conflicts:
+                    index_conflicts[fieldname] = [IndexIssue(fieldname=fieldname), ]
+                index_conflicts[fieldname][0].defined_types.update(types)
 
         return index_conflicts
 
 
 TemplateDiffResult = collections.namedtuple('TemplateDiffResult',
-                                            ['type_states', 'template_states'],
-                                            verbose=True)
+                                            ['type_states', 'template_states'])
 
 
 class TemplateDiffer(object):
@@ -326,8 +384,6 @@ class TemplateDiffer(object):
         self.source = normalize_mapping(source)  # mapping generated by a mapper
         self.dest = normalize_mapping(dest)  # mapping present in ES
 
-        self.diff()
-
     def diff(self):
         # test missing and extra types
         local_types = set(self.source.keys())
@@ -347,31 +403,12 @@ class TemplateDiffer(object):
             result.type_states[common_type] = differ.diff()
 
         # check inconsistent fields (i.e. fields declared with same name and different types)
-        # TODO: refactor this mess into something more functional
-        items = six.iteritems(self.source)
-        for i, (typename1, mapping1) in enumerate(items):
-            for j, (typename2, mapping2) in enumerate(items):
-                if typename1 != typename2:
-                    duplicated_fields = set(mapping1['properties']) & set(mapping2['properties'])
-                    for duplicated_field in duplicated_fields:
-                        differ = MappingDiffer(duplicated_field,
-                                               mapping1['properties'],
-                                               mapping2['properties'])
-                        diff = differ.diff()
-                        # mark a conflict if the duplicated fields have different types
-                        if all([duplicated_field in diff,
-                                diff[duplicated_field][0].state != State.ok]):
-                            state = MappingState(fieldname=duplicated_field,
-                                                 state=State.inconsistent_field)
-                            # add inconsistence conflict for typename 1
-                            if typename1 not in result.type_states:
-                                result.type_states[typename1] = collections.OrderedDict()
-                            result.type_states[typename1][duplicated_field] = [state, ]
-
-                            # add inconsistence conflict for typename 2
-                            if typename2 not in result.type_states:
-                                result.type_states[typename2] = collections.OrderedDict()
-                            result.type_states[typename2][duplicated_field] = [state, ]
+        for fieldname, typenames in six.iteritems(self._compute_inconsistent_fields()):
+            state = MappingState(fieldname=fieldname, state=State.inconsistent_field)
+            for typename in typenames:
+                if typename not in result.type_states:
+                    result.type_states[typename] = collections.OrderedDict()
+                result.type_states[typename][fieldname] = [state, ]
 
         for extra_type in extra_types:
             state = TemplateState(typename=extra_type, state=State.template_extra_type)
@@ -382,3 +419,84 @@ class TemplateDiffer(object):
             result.template_states.append(state)
 
         return result
+
+    def _compute_inconsistent_fields(self):
+        """
+        Get the fields declared differently in different types of the template.
+
+        Groups the definitions of every field (nested ones by their full path)
+        across all the types in a single pass. Returns a `fieldname -> [typenames]`
+        dict with the types declaring each inconsistent field.
+        """
+        definitions = collections.OrderedDict()
+        for typename, mapping in six.iteritems(self.source):
+            for fieldname, attrs in gen_mapping_fields(mapping['properties']):
+                typenames = definitions.setdefault(fieldname, collections.OrderedDict())
+                typenames.setdefault(freeze_mapping(attrs), []).append(typename)
+
+        inconsistent_fields = collections.OrderedDict()
+        for fieldname, typenames in six.iteritems(definitions):
+            if len(typenames) > 1:
+                inconsistent_fields[fieldname] = [typename
+                                                  for group in typenames.values()
+                                                  for typename in group]
+        return inconsistent_fields
+
+
+def diff_timely_index(args):
+    """
+    Run a `TimelyIndexDiffer` from an `(template_name, source, index_pattern, mappings)` tuple.
+
+    Used as the task of a process pool, so `mappings` should only contain the
+    indices matching `index_pattern` to keep the task small.
+    """
+    template_name, source, index_pattern, mappings = args
+    return TimelyIndexDiffer(template_name, source, index_pattern, mappings).diff()
+
+
+def diff_template(args):
+    "Run a `TemplateDiffer` from an `(template_name, source, dest)` tuple (see `diff_timely_index`)"
+    template_name, source, dest = args
+    return TemplateDiffer(template_name, source, dest).diff()
+
+
+def _gen_settings(settings, prefix=''):
+    for key, value in six.iteritems(settings):
+        if isinstance(value, dict):
+            for item in _gen_settings(value, prefix + key + '.'):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+def _setting_text(value):
+    if isinstance(value, (list, tuple)):
+        return [_setting_text(item) for item in value]
+    if isinstance(value, six.string_types):
+        return value
+    return json.dumps(value)
+
+
+def canonical_template(template):
+    """
+    Get the parts of an index template `sync` pushes, as Elasticsearch returns them.
+
+    Settings are flattened into `index.` prefixed keys with text values, so a
+    template generated by the project and the same template fetched from
+    Elasticsearch are equal.
+    """
+    settings = {}
+    for key, value in _gen_settings(template.get('settings') or {}):
+        if not key.startswith('index.'):
+            key = 'index.' + key
+        settings[key] = _setting_text(value)
+    return {
+        'template': template.get('template'),
+        'settings': settings,
+        'mappings': template.get('mappings') or {},
+    }
+
+
+def hash_template(template):
+    "Hash of the canonical JSON of `template` (see `canonical_template`)"
+    return hashlib.sha1(canonical_json(canonical_template(template)).encode('utf-8')).hexdigest()
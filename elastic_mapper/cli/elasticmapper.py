@@ -1,34 +1,90 @@
 import collections
+import contextlib
 import json
 import os
-from pygments import highlight, lexers, formatters
-from tabulate import tabulate
-from termcolor import colored
-from elasticsearch import Elasticsearch
 
 import click
 import six
+from termcolor import colored
 
 import loaders
 import differs
+import snapshots
 
-from differs import State
+from differs import State, SyncState
 
 
 MAPPING_COLOR = "cyan"
 TEMPLATE_COLOR = "magenta"
 SEP_COUNT = 10
+SYNC_JOBS = 4
 
 ES_HOST = {
     "host": 'localhost',
     "port": 9200,
 }
-es = Elasticsearch(hosts=[ES_HOST])
 
 
 @click.group()
-def cli():
-    pass
+@click.option('--host', default=ES_HOST['host'], envvar='ELASTICMAPPER_HOST',
+              help='Elasticsearch host.')
+@click.option('--port', default=ES_HOST['port'], type=int, envvar='ELASTICMAPPER_PORT',
+              help='Elasticsearch port.')
+@click.pass_context
+def cli(ctx, host, port):
+    # the client (and the elasticsearch package) are only loaded by the commands using it
+    ctx.obj = {'hosts': [{'host': host, 'port': port}], 'es': None}
+
+
+def get_es(**kwargs):
+    """
+    Return the Elasticsearch client of the current command, creating it on first use.
+
+    `kwargs` are passed to the client when it is created (e.g. `maxsize`, the
+    size of its connection pool).
+    """
+    obj = click.get_current_context().find_root().obj
+    if obj['es'] is None:
+        from elasticsearch import Elasticsearch
+        obj['es'] = Elasticsearch(hosts=obj['hosts'], **kwargs)
+    return obj['es']
+
+
+def get_loader(path):
+    "Return the loader of the project manifest if it is up to date, or import the project"
+    return loaders.ManifestMappingLoader.load(path) or loaders.ProjectMappingLoader(path)
+
+
+def print_json(data):
+    "Print `data` as highlighted JSON"
+    from pygments import highlight, lexers, formatters
+    print(highlight(six.text_type(json.dumps(data, indent=4)),
+                    lexers.JsonLexer(),
+                    formatters.TerminalFormatter()))
+
+
+@contextlib.contextmanager
+def imap_jobs(func, tasks, jobs):
+    """
+    Apply `func` to every task using `jobs` processes (0 for one per CPU).
+
+    Gives an iterator of the results, in the same order as `tasks`. The worker
+    processes are terminated when the `with` block exits, even on errors.
+    """
+    import multiprocessing
+
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    if jobs == 1 or len(tasks) < 2:
+        yield (func(task) for task in tasks)
+        return
+
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        yield pool.imap(func, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 @cli.command()
@@ -41,30 +97,26 @@ def cli():
               help='Show template data from project')
 def show(path, show_mappings, show_templates):
     path = os.path.abspath(path)
-    loader = loaders.ProjectMappingLoader(path)
+    loader = get_loader(path)
 
     if show_mappings:
         mappings = loader.get_mappings()
         click.secho("*" * SEP_COUNT + " MAPPINGS " + "*" * SEP_COUNT, fg=MAPPING_COLOR)
         for name, mapping in mappings.items():
             click.secho("%s:" % name, fg=MAPPING_COLOR)
-            data = json.dumps(mapping, indent=4)
-            print(highlight(six.text_type(data),
-                            lexers.JsonLexer(),
-                            formatters.TerminalFormatter()))
+            print_json(mapping)
 
     if show_templates:
         templates = loader.get_templates()
         click.secho("*" * SEP_COUNT + " TEMPLATES " + "*" * SEP_COUNT, fg=TEMPLATE_COLOR)
         for name, template in templates.items():
             click.secho("%s:" % name, fg=TEMPLATE_COLOR)
-            data = json.dumps(template, indent=4)
-            print(highlight(six.text_type(data),
-                            lexers.JsonLexer(),
-                            formatters.TerminalFormatter()))
+            print_json(template)
 
 
 def print_mapping_state(typename, states):
+    from tabulate import tabulate
+
     table = []
     symbols = {
         State.ok: 'green',
@@ -129,48 +181,56 @@ def print_template_state(template, states):
               help='Show mapping data from project')
 @click.option('--templates', 'show_templates', is_flag=True, default=False,
               help='Show template data from project')
-def diff(path, show_mappings, show_templates):
-    # import pprint
+@click.option('--from-snapshot', 'snapshot_path', default=None,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Diff against a snapshot file (see `snapshot`) instead of Elasticsearch')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=0),
+              help='Number of processes used to diff (0 for one per CPU)')
+def diff(path, show_mappings, show_templates, snapshot_path, jobs):
+    if not show_mappings and not show_templates:
+        # nothing to diff, do not load the project nor the cluster state
+        return
+
     path = os.path.abspath(path)
-    loader = loaders.ProjectMappingLoader(path)
+    loader = get_loader(path)
+
+    # get the cluster state once for the whole run, keeping only the project indices
+    index_patterns = [template.index for template in loader.templates.values()]
+    if snapshot_path:
+        cluster = snapshots.ClusterSnapshot.load(snapshot_path, index_patterns=index_patterns)
+    else:
+        cluster = snapshots.ClusterSnapshot.fetch(get_es(), mappings=show_mappings,
+                                                  templates=show_templates,
+                                                  index_patterns=index_patterns)
 
     if show_mappings:
-        es_mappings = es.indices.get_mapping(index='*')
-        data = json.dumps(es_mappings, indent=4)
-        print(highlight(six.text_type(data), lexers.JsonLexer(), formatters.TerminalFormatter()))
+        print_json(cluster.mappings)
         # group types by index
         templates = collections.defaultdict(list)
         for name, mapper in loader.mappings.items():
             templates[mapper.template].append(mapper)
 
-        for template, mappers in six.iteritems(templates):
-            print("Template " +
-                  colored(template.name, attrs=['bold', ]) +
-                  " (%s):\n" % template.parse_index_template())
-            for mapper in mappers:
-                es_mappings = es.indices.get_mapping(index="*")
-                differ = differs.TimelyIndexDiffer(template.name,
-                                                   mapper.generate_mapping(),
-                                                   template.index,
-                                                   es_mappings)
-                states = differ.diff()
+        # sort the diffs to print them in the same order regardless of the number of jobs
+        diffs = []
+        for template in sorted(templates, key=lambda template: template.name):
+            matching_mappings = dict((index_name, cluster.mappings[index_name])
+                                     for index_name in cluster.catalog.match(template.index))
+            for mapper in sorted(templates[template], key=lambda mapper: mapper.typename):
+                diffs.append((template, mapper, (template.name,
+                                                 mapper.generate_mapping(),
+                                                 template.index,
+                                                 matching_mappings)))
+
+        tasks = [task for _, _, task in diffs]
+        with imap_jobs(differs.diff_timely_index, tasks, jobs) as results:
+            last_template = None
+            for (template, mapper, _), states in zip(diffs, results):
+                if template is not last_template:
+                    print("Template " +
+                          colored(template.name, attrs=['bold', ]) +
+                          " (%s):\n" % template.parse_index_template())
+                    last_template = template
                 print_mapping_state(mapper.typename, states)
-                # matches = parsers.get_matching_indexes(mapper.template.index, es_mappings)
-                # # TODO: control conflicts in different timed indices instead of looping here
-                # for match in matches:
-                #     # print "***********"
-                #     # print "mapper mapping:"
-                #     # pprint.pprint(mapping.generate_mapping())
-                #     # print "ES mapping:"
-                #     # pprint.pprint(es_mappings[match]['mappings'])
-                #     local_mapping = mapper.generate_mapping()[mapper.typename]['properties']
-                #     es_mapping = es_mappings[match]['mappings'][mapper.typename]['properties']
-                #     differ = differs.MappingDiffer(name,
-                #                                    local_mapping,
-                #                                    es_mapping)
-                #     states = differ.diff()
-                #     print_mapping_state(mapper.typename, states)
-                #     print('\n')
 
     if show_templates:
         templates = loader.get_templates()
@@ -179,23 +239,90 @@ def diff(path, show_mappings, show_templates):
                   colored(path, 'red'))
             return
 
-        for name, template in templates.items():
-            exists = es.indices.exists_template(name)
-            if not exists:
-                print(colored("Template ", 'red') +
-                      colored(name, 'red', attrs=['bold', ]) +
-                      colored(" does not exist in ES ", 'red'))
-            else:
-                es_template = es.indices.get_template(name)
-                data = json.dumps(es_template, indent=4)
-                print(highlight(six.text_type(data),
-                                lexers.JsonLexer(),
-                                formatters.TerminalFormatter()))
-                differ = differs.TemplateDiffer(name,
-                                                template['mappings'],
-                                                es_template[name]['mappings'])
-                states = differ.diff()
-                print_template_state(loader.templates[name], states)
+        names = sorted(templates)
+        es_templates = dict((name, cluster.get_template(name)) for name in names)
+        tasks = [(name, templates[name]['mappings'], es_templates[name][name]['mappings'])
+                 for name in names if es_templates[name] is not None]
+        with imap_jobs(differs.diff_template, tasks, jobs) as results:
+            for name in names:
+                es_template = es_templates[name]
+                if es_template is None:
+                    print(colored("Template ", 'red') +
+                          colored(name, 'red', attrs=['bold', ]) +
+                          colored(" does not exist in ES ", 'red'))
+                else:
+                    print_json(es_template)
+                    print_template_state(loader.templates[name], next(results))
+
+
+@cli.command('compile')
+@click.option('--path',
+              default=os.getcwd(),
+              help='Path to the project with Mappers.')
+def compile_manifest(path):
+    """Save the project templates and mappings to a manifest used instead of importing it."""
+    path = os.path.abspath(path)
+    loader = loaders.ProjectMappingLoader(path)
+    manifest_path = os.path.join(path, loaders.MANIFEST_NAME)
+    with open(manifest_path, 'w') as f:
+        json.dump(loader.compile(), f, separators=(',', ':'))
+    click.secho("Compiled %d templates and %d mappings to %s" % (len(loader.templates),
+                                                                 len(loader.mappings),
+                                                                 manifest_path),
+                fg='green')
+
+
+@cli.command()
+@click.option('--output', default=snapshots.DEFAULT_SNAPSHOT_PATH,
+              type=click.Path(dir_okay=False),
+              help='Path of the snapshot file.')
+def snapshot(output):
+    """Save the mappings and templates in Elasticsearch to a compressed file."""
+    snapshots.ClusterSnapshot.download(get_es(), output)
+    click.secho("Saved Elasticsearch snapshot to %s" % output, fg='green')
+
+
+def put_templates(es, templates, jobs):
+    """
+    Put the `(name, template)` pairs into Elasticsearch, `jobs` at a time.
+
+    Returns a `name -> (SyncState, detail)` dict.
+    """
+    from elasticsearch import TransportError
+    from multiprocessing.pool import ThreadPool
+
+    def put_template(item):
+        name, template = item
+        try:
+            response = es.indices.put_template(name=name, body=template)
+        except TransportError as e:
+            return name, (SyncState.failed, six.text_type(e))
+        if not response.get('acknowledged'):
+            return name, (SyncState.failed, 'not acknowledged')
+        return name, (SyncState.changed, '')
+
+    pool = ThreadPool(min(jobs, len(templates)))
+    try:
+        return dict(pool.map(put_template, templates))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_sync_state(results):
+    from tabulate import tabulate
+
+    table = []
+    symbols = {
+        SyncState.changed: 'green',
+        SyncState.unchanged: 'blue',
+        SyncState.failed: 'red',
+    }
+    for name in sorted(results):
+        state, detail = results[name]
+        color = symbols[state]
+        table.append([colored(name, color, attrs=['bold', ]), colored(state.name, color), detail])
+    print(tabulate(table, ['Template', 'State', 'Detail'], tablefmt='fancy_grid'))
 
 
 @cli.command()
@@ -210,15 +337,20 @@ def diff(path, show_mappings, show_templates):
               help="Don't prompt for confirmation when pushing to Elasticsearch")
 @click.option('--dry', 'dry_run', is_flag=True, default=False,
               help="Show the steps to be performed without actually running them")
-def sync(path, sync_mappings, sync_templates, skip_confirmation, dry_run):
+@click.option('--force', is_flag=True, default=False,
+              help="Put all the templates, even the ones unchanged in Elasticsearch")
+@click.option('--jobs', '-j', default=SYNC_JOBS, type=click.IntRange(min=1),
+              help='Number of templates put into Elasticsearch concurrently')
+def sync(path, sync_mappings, sync_templates, skip_confirmation, dry_run, force, jobs):
     path = os.path.abspath(path)
-    loader = loaders.ProjectMappingLoader(path)
+    loader = get_loader(path)
 
     if sync_mappings:
         raise NotImplementedError(colored("Mapping sync is not supported yet", 'red'))
 
     if sync_templates:
-        if not loader.get_templates():
+        local_templates = loader.get_templates()
+        if not local_templates:
             print(colored("No templates found in ", 'red', attrs=['bold', ]) +
                   colored(path, 'red'))
             return
@@ -233,17 +365,23 @@ def sync(path, sync_mappings, sync_templates, skip_confirmation, dry_run):
             for mapper in mappers:
                 click.echo("      - %s" % (mapper.typename))
 
-        if not skip_confirmation:
-            click.confirm("Are you sure you want to put the project templates into Elasticsearch?",
-                          abort=True)
-        for name, template in loader.get_templates().items():
-            click.echo("Putting template %s..." % name)
-            if not dry_run:
-                es.indices.put_template(name, template)
-            exists = es.indices.exists_template(name)
-            if exists or dry_run:
-                click.secho("Successfully added template %s to Elasticsearch" % name,
-                            fg='green')
-            else:
-                click.secho("Error adding template %s to Elasticsearch" % name,
-                            fg='red')
+        # fetch all the templates in a single request and only put the changed ones
+        es = get_es(maxsize=jobs)
+        es_templates = es.indices.get_template()
+        names = sorted(local_templates)
+        changed = [name for name in names
+                   if force or name not in es_templates or
+                   differs.hash_template(local_templates[name]) !=
+                   differs.hash_template(es_templates[name])]
+        results = dict((name, (SyncState.unchanged, '')) for name in names)
+
+        if changed and not dry_run:
+            if not skip_confirmation:
+                click.confirm("Are you sure you want to put %d changed templates into "
+                              "Elasticsearch?" % len(changed), abort=True)
+            results.update(put_templates(es, [(name, local_templates[name]) for name in changed],
+                                         jobs))
+        else:
+            results.update((name, (SyncState.changed, 'dry run')) for name in changed)
+
+        print_sync_state(results)
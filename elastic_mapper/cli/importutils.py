@@ -1,13 +1,29 @@
 """
 Utility module to inspect external python projects.
 """
+import ast
+import hashlib
 import imp
 import inspect
+import json
 import os
 import sys
 
 __author__ = "Joan Grau, @grautxo"
 
+# the discovery cache is kept out of the scanned projects, on this directory
+# or on the user cache directory (`$XDG_CACHE_HOME` or `~/.cache`)
+DISCOVERY_CACHE_ENV = 'ELASTICMAPPER_CACHE_DIR'
+DISCOVERY_CACHE_NAME = 'discovery-{key}.json'
+DISCOVERY_CACHE_VERSION = 4
+
+# base class that can not be resolved statically (e.g. `six.with_metaclass(...)`)
+DYNAMIC_BASE = '*'
+# package whose classes are resolved by name
+LIBRARY = 'elastic_mapper'
+# names of the functions importing modules dynamically
+DYNAMIC_IMPORTS = ('__import__', 'import_module', 'load_module', 'load_source')
+
 
 def is_list(obj):
     """
@@ -30,7 +46,7 @@ def to_tuple(obj):
     return to_list(obj, class_type=tuple)
 
 
-def import_module(file_path='', sep=os.path.sep, pyclean=True):
+def import_module(file_path='', sep=os.path.sep, pyclean=False):
     """
     Imports a module from a gitven @file_path.
     """
@@ -71,11 +87,193 @@ def import_non_local(name, custom_name=None, paths=None):
     return module
 
 
-def search_subclasses(module_path, parent_classes):
+def get_loaded_module(file_path):
+    """
+    Returns the module already imported from the given @file_path, if any.
+    """
+    path, ext = os.path.splitext(os.path.abspath(file_path))
+    module = sys.modules.get(os.path.basename(path))
+    module_file = getattr(module, '__file__', None)
+    if module_file and os.path.splitext(os.path.abspath(module_file))[0] == path:
+        return module
+    return None
+
+
+def _base_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return DYNAMIC_BASE
+
+
+def _root_name(node):
+    while isinstance(node, ast.Attribute):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def scan_source(source):
+    """
+    Statically scan the python @source without importing it.
+    Returns the classes defined on it as a list of (name, base names, base
+    names imported from outside elastic_mapper), the names imported with an
+    alias as a dict of alias -> imported name, the sorted list of names it
+    references, the sorted list of top level modules it imports from and
+    whether the scan is inconclusive (e.g. star or dynamic imports, or
+    invalid syntax), so the source must be imported.
+    """
+    classes = []
+    aliases = {}
+    names = set()
+    modules = set()
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return classes, aliases, [], [], True
+    inconclusive = False
+    class_nodes = []
+    # local name -> top level module it is imported from ('.' when relative)
+    imported = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            class_nodes.append(node)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if isinstance(node, ast.ImportFrom) and node.module:
+                modules.add(node.module.split('.', 1)[0])
+            for alias in node.names:
+                if alias.name == '*':
+                    inconclusive = True
+                    continue
+                if isinstance(node, ast.Import):
+                    module = alias.name.split('.', 1)[0]
+                    modules.add(module)
+                    imported[alias.asname or module] = module
+                else:
+                    module = node.module.split('.', 1)[0] if node.module and not node.level else '.'
+                    imported[alias.asname or alias.name] = module
+                name = alias.name.rsplit('.', 1)[-1]
+                names.add(name)
+                if alias.asname:
+                    aliases[alias.asname] = name
+        elif isinstance(node, (ast.Name, ast.Attribute)):
+            name = _base_name(node)
+            names.add(name)
+            if name in DYNAMIC_IMPORTS:
+                inconclusive = True
+
+    for node in class_nodes:
+        bases = set(_base_name(base) for base in node.bases)
+        imported_bases = set(_base_name(base) for base in node.bases
+                             if imported.get(_root_name(base), LIBRARY) != LIBRARY)
+        classes.append((node.name, sorted(bases), sorted(imported_bases)))
+    return classes, aliases, sorted(names), sorted(modules), inconclusive
+
+
+def get_cache_path(module_path):
+    """
+    Returns the path of the discovery cache file of @module_path, on the
+    `ELASTICMAPPER_CACHE_DIR` directory or the elasticmapper directory of the
+    user cache directory.
+    """
+    cache_dir = os.environ.get(DISCOVERY_CACHE_ENV)
+    if not cache_dir:
+        user_cache_dir = (os.environ.get('XDG_CACHE_HOME') or
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(user_cache_dir, 'elasticmapper')
+    key = hashlib.sha1(os.path.abspath(module_path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, DISCOVERY_CACHE_NAME.format(key=key))
+
+
+def scan_files(module_path, file_names):
+    """
+    Returns a dict of file name -> `scan_source` result for each of the
+    @file_names on @module_path.
+    Results are cached on the user cache directory (see `get_cache_path`) and
+    files are only scanned again when their modification time or size change.
+    """
+    cache_path = get_cache_path(module_path)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get('version') != DISCOVERY_CACHE_VERSION:
+            cache = None
+    except (IOError, OSError, ValueError):
+        cache = None
+    entries = cache['files'] if cache else {}
+
+    scans = {}
+    stale = False
+    for file_name in file_names:
+        stat = os.stat(os.path.join(module_path, file_name))
+        key = [stat.st_mtime, stat.st_size]
+        entry = entries.get(file_name)
+        if entry is None or entry['key'] != key:
+            with open(os.path.join(module_path, file_name), 'rb') as f:
+                classes, aliases, names, modules, inconclusive = scan_source(f.read())
+            entry = entries[file_name] = {'key': key, 'classes': classes,
+                                          'aliases': aliases, 'names': names,
+                                          'modules': modules, 'inconclusive': inconclusive}
+            stale = True
+        scans[file_name] = ([(name, set(bases), set(imported_bases))
+                             for name, bases, imported_bases in entry['classes']],
+                            entry['aliases'], set(entry['names']), set(entry['modules']),
+                            entry['inconclusive'])
+
+    for file_name in set(entries) - set(file_names):
+        del entries[file_name]
+        stale = True
+
+    if stale:
+        try:
+            if not os.path.isdir(os.path.dirname(cache_path)):
+                os.makedirs(os.path.dirname(cache_path))
+            with open(cache_path, 'w') as f:
+                json.dump({'version': DISCOVERY_CACHE_VERSION, 'files': entries}, f)
+        except (IOError, OSError):
+            # without a writable cache directory files are scanned every time
+            pass
+    return scans
+
+
+def find_candidates(scans, class_names, packages=()):
+    """
+    Returns the sorted file names of @scans (see `scan_files`) that must be
+    imported to find the subclasses of any of @class_names: the ones defining
+    or referencing a class that may be a subclass (e.g. modules registering
+    mappers into a template), importing from any of the project @packages
+    (whose modules are not scanned) or whose scan is inconclusive.
+    A class is a candidate when any of its bases is a candidate, an alias of
+    a candidate or can not be resolved statically: an expression, or a name
+    imported from outside elastic_mapper that no scanned file defines (e.g. a
+    base template of another library).
+    """
+    defined = set(name for scan in scans.values() for name, bases, imported_bases in scan[0])
+    names = set(class_names)
+    size = None
+    while size != len(names):
+        size = len(names)
+        for scan in scans.values():
+            classes, aliases = scan[:2]
+            names.update(alias for alias, name in aliases.items() if name in names)
+            names.update(name for name, bases, imported_bases in classes
+                         if DYNAMIC_BASE in bases or bases & names or
+                         any(aliases.get(base, base) not in defined for base in imported_bases))
+    subclass_names = names - set(class_names)
+    packages = set(packages)
+    return sorted(file_name for file_name, (classes, aliases, referenced, modules, inconclusive)
+                  in scans.items()
+                  if any(name in names for name, bases, imported_bases in classes) or
+                  referenced & subclass_names or modules & packages or inconclusive)
+
+
+def search_subclasses(module_path, parent_classes, pyclean=False):
     """
     Returns a list of classes if the class is a subclass from any of
     @parent_classes on the specified @module_path.
     Argument @parent_classes can be a class, a list or a tuple of classes.
+    Only the submodules that may define a subclass (see `find_candidates`)
+    are imported.
     """
     class_set = set()
     parent_classes = to_tuple(parent_classes)
@@ -85,14 +283,18 @@ def search_subclasses(module_path, parent_classes):
     if '__init__.py' not in files:
         return []
 
-    # Get all subclasses on each submodule
-    for f in files:
-        if f == '__init__.py' or not f.endswith('.py'):
-            continue
-        file_name, ext = os.path.splitext(f)
-        package = os.path.join(module_path, file_name).replace(os.sep, '.')
-        # Import the module and get the classes
-        module = import_module(package.replace('.py', ''))
+    packages = [f for f in files
+                if os.path.isfile(os.path.join(module_path, f, '__init__.py'))]
+    files = [f for f in files if f != '__init__.py' and f.endswith('.py')]
+    scans = scan_files(module_path, files)
+    candidates = find_candidates(scans, [p.__name__ for p in parent_classes], packages)
+
+    # Get all subclasses on each candidate submodule
+    for f in candidates:
+        # Import the module (unless a previous one already did, to get the
+        # same classes with their registered types) and get the classes
+        file_path = os.path.join(module_path, f)
+        module = get_loaded_module(file_path) or import_module(file_path, pyclean=pyclean)
         for value in module.__dict__.values():
             # Add the class to the results if value is a subclass of
             # any of @parent_classes
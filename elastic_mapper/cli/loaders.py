@@ -1,11 +1,18 @@
+import collections
+import hashlib
+import json
 import os
 from abc import ABCMeta, abstractmethod
 
 import six
 
 import importutils
+import elastic_mapper
 from elastic_mapper.templates import Template
 
+MANIFEST_NAME = '.elasticmapper-manifest.json'
+MANIFEST_VERSION = 1
+
 
 @six.add_metaclass(ABCMeta)
 class AbstractMappingLoader(object):
@@ -19,6 +26,28 @@ class AbstractMappingLoader(object):
         pass
 
 
+def pyfiles(path):
+    for root, dirs, files in os.walk(path, topdown=False):
+        pyfiles = (f for f in files if f.split(os.extsep, 1)[-1] == 'py')
+        for name in pyfiles:
+            yield os.path.join(root, name)
+
+
+def get_source_hash(path):
+    """
+    Returns a hash of the python sources of the project in @path and of
+    elastic_mapper, which generates the mappings from them.
+    """
+    digest = hashlib.sha1()
+    for base in (path, os.path.dirname(elastic_mapper.__file__)):
+        for file_path in sorted(pyfiles(base)):
+            digest.update(os.path.relpath(file_path, base).encode('utf-8') + b'\0')
+            with open(file_path, 'rb') as f:
+                digest.update(f.read())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
 class ProjectMappingLoader(AbstractMappingLoader):
 
     def __init__(self, path):
@@ -29,11 +58,7 @@ class ProjectMappingLoader(AbstractMappingLoader):
         self.load()
 
     def pyfiles(self):
-        for root, dirs, files in os.walk(self.path, topdown=False):
-            pyfiles = (f for f in files if f.split(os.extsep, 1)[-1] == 'py')
-            for name in pyfiles:
-                path = os.path.join(root, name)
-                yield path
+        return pyfiles(self.path)
 
     def load(self):
         templates = importutils.search_subclasses(self.path, Template)
@@ -53,3 +78,102 @@ class ProjectMappingLoader(AbstractMappingLoader):
         for name, template in self.templates.items():
             ret[name] = template.generate_template()
         return ret
+
+    def compile(self, source_hash=None):
+        """
+        Returns the manifest of the project (see `ManifestMappingLoader`).
+        """
+        templates = collections.OrderedDict()
+        for name in sorted(self.templates):
+            template = self.templates[name]
+            templates[name] = {
+                'index': template.index,
+                'template': template.generate_template(),
+            }
+        mappings = collections.OrderedDict()
+        for name in sorted(self.mappings):
+            mapper = self.mappings[name]
+            mappings[name] = {
+                'template': mapper.template.name,
+                'mapping': mapper.generate_mapping(),
+            }
+        return {
+            'version': MANIFEST_VERSION,
+            'source_hash': source_hash or get_source_hash(self.path),
+            'templates': templates,
+            'mappings': mappings,
+        }
+
+
+class CompiledTemplate(object):
+    """
+    Template loaded from a manifest, with the `Template` attributes used by
+    the CLI.
+    """
+
+    def __init__(self, name, index, template):
+        self.name = name
+        self.index = index
+        self.template = template
+
+    def generate_template(self):
+        return self.template
+
+    def parse_index_template(self):
+        return self.template['template']
+
+
+class CompiledMapper(object):
+    """
+    Mapper loaded from a manifest, with the `Mapper` attributes used by the
+    CLI.
+    """
+
+    def __init__(self, typename, template, mapping):
+        self.typename = typename
+        self.template = template
+        self.mapping = mapping
+
+    def generate_mapping(self):
+        return self.mapping
+
+
+class ManifestMappingLoader(AbstractMappingLoader):
+    """
+    Loads the templates and mappings of a project from the manifest written
+    by `elasticmapper compile`, without importing the project.
+    """
+
+    def __init__(self, manifest):
+        self.templates = {}
+        self.mappings = {}
+        for name, data in manifest['templates'].items():
+            self.templates[name] = CompiledTemplate(name, data['index'], data['template'])
+        for name, data in manifest['mappings'].items():
+            self.mappings[name] = CompiledMapper(name, self.templates[data['template']],
+                                                 data['mapping'])
+
+    @classmethod
+    def load(cls, path, manifest_path=None):
+        """
+        Returns the loader of the manifest of the project in @path, or None if
+        there is no manifest or the project sources changed since it was
+        compiled.
+        """
+        manifest_path = manifest_path or os.path.join(path, MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f, object_pairs_hook=collections.OrderedDict)
+        except (IOError, OSError, ValueError):
+            return None
+        if (manifest.get('version') != MANIFEST_VERSION or
+                manifest.get('source_hash') != get_source_hash(path)):
+            return None
+        return cls(manifest)
+
+    def get_mappings(self):
+        return dict((name, mapper.generate_mapping()) for name, mapper in self.mappings.items())
+
+    def get_templates(self):
+        return dict((name, template.generate_template())
+                    for name, template in self.templates.items())
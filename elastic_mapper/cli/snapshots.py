@@ -0,0 +1,270 @@
+"""
+Cluster state (index mappings and templates) used by the diff command.
+
+Mapping responses of large clusters can be hundreds of MB of JSON, so they
+are parsed incrementally: only one index mapping is decoded at a time and
+only the indices matching the given index patterns are kept.
+
+Snapshot files are gzipped, with a JSON header line (format version,
+creation time and templates) followed by the `_mapping` response body as
+returned by Elasticsearch, so they are written without parsing the mappings.
+"""
+import codecs
+import gzip
+import json
+import re
+
+import arrow
+
+from elastic_mapper import parsers
+from elastic_mapper.cli.differs import normalize_mapping
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_PATH = 'elasticmapper-snapshot.json.gz'
+CHUNK_SIZE = 64 * 1024
+# largest value (e.g. the mapping of one index) decoded by `JSONObjectStream`, in characters
+MAX_VALUE_SIZE = 64 * 1024 * 1024
+
+INVALID_SNAPSHOT_MESSAGE = 'File `{path}` is not a valid elasticmapper snapshot.'
+INVALID_JSON_MESSAGE = 'Expected one of `{expected}` at position {position}, got `{found}`.'
+VALUE_TOO_LARGE_MESSAGE = 'Invalid JSON or value larger than {max_size} characters: {error}'
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+class JSONObjectStream(object):
+    """
+    Incremental parser of a JSON object read from an iterable of text chunks.
+
+    `items` yields the `(key, value)` pairs of the object one by one, so only
+    the value being decoded is held in memory besides the pending text.
+
+    A value that cannot be decoded is read until its text exceeds
+    `max_value_size` characters, since invalid JSON cannot be told apart from
+    an incomplete value, so invalid input fails without buffering the stream.
+    """
+
+    def __init__(self, chunks, max_value_size=MAX_VALUE_SIZE):
+        self._chunks = iter(chunks)
+        self._max_value_size = max_value_size
+        self._buffer = ''
+        self._pos = 0
+
+    def _read_more(self):
+        """
+        Read at least as much text as is pending, dropping the consumed text.
+
+        Growing the buffer geometrically keeps the re-decoding of values spanning
+        many chunks linear. Returns False when no text is left.
+        """
+        pending = self._buffer[self._pos:]
+        parts = [pending]
+        size = 0
+        for chunk in self._chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size and size >= len(pending):
+                break
+        self._buffer = ''.join(parts)
+        self._pos = 0
+        return size > 0
+
+    def _next_char(self):
+        while True:
+            self._pos = WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ''
+
+    def _expect(self, expected):
+        char = self._next_char()
+        if not char or char not in expected:
+            raise ValueError(INVALID_JSON_MESSAGE.format(expected=expected,
+                                                         position=self._pos,
+                                                         found=char))
+        self._pos += 1
+        return char
+
+    def _decode(self):
+        self._next_char()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except ValueError as error:
+                # incomplete value
+                if len(self._buffer) - self._pos > self._max_value_size:
+                    raise ValueError(VALUE_TOO_LARGE_MESSAGE.format(
+                        max_size=self._max_value_size, error=error))
+                if not self._read_more():
+                    raise
+                continue
+            # numbers at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            yield key, self._decode()
+            if self._expect(',}') == '}':
+                return
+
+
+def iter_text(byte_chunks):
+    "Decode an iterable of UTF-8 byte chunks into text chunks"
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in byte_chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', True)
+
+
+def get_streaming_connection(es):
+    """
+    Get a connection of the `es` client exposing a urllib3 pool, or None.
+
+    This relies on the transport internals of elasticsearch-py 5.x to 7.x; other
+    client versions and connection classes are not streamed.
+    """
+    get_connection = getattr(getattr(es, 'transport', None), 'get_connection', None)
+    if get_connection is None:
+        return None
+    connection = get_connection()
+    if all(hasattr(connection, attr) for attr in ('pool', 'url_prefix', 'headers', 'timeout')):
+        return connection
+    return None
+
+
+def iter_mappings(es):
+    """
+    Stream the `_mapping` response body through a connection of the `es` client
+    as byte chunks, so its scheme, authentication, url prefix, headers and
+    timeout are honored.
+
+    Falls back to a (non streamed) `es.indices.get_mapping()` call when the
+    client connection cannot be streamed.
+    """
+    connection = get_streaming_connection(es)
+    if connection is None:
+        mappings = es.indices.get_mapping()
+        # elasticsearch-py 8.x wraps the body in an `ObjectApiResponse`
+        yield json.dumps(getattr(mappings, 'body', mappings)).encode('utf-8')
+        return
+
+    import elasticsearch
+
+    response = connection.pool.urlopen('GET', connection.url_prefix + '/_mapping',
+                                       headers=connection.headers,
+                                       timeout=connection.timeout, retries=False,
+                                       preload_content=False)
+    try:
+        if response.status != 200:
+            raise elasticsearch.TransportError(response.status, response.read())
+        for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+            yield chunk
+    finally:
+        response.release_conn()
+
+
+def filter_mappings(items, index_patterns=None):
+    """
+    Build the normalized mappings dict from `(index_name, mapping)` items.
+
+    Only the indices matching some index pattern (e.g. `index-prefix-{time}`)
+    are kept when `index_patterns` is given. Every index mapping is normalized
+    as soon as it is decoded.
+    """
+    if index_patterns is not None:
+        patterns = [parsers.compile_index_pattern(key) for key in index_patterns]
+        items = ((index_name, mapping) for index_name, mapping in items
+                 if any(pattern.match(index_name) for pattern in patterns))
+    return normalize_mapping(dict((index_name, normalize_mapping(mapping))
+                                  for index_name, mapping in items))
+
+
+class ClusterSnapshot(object):
+    """
+    Mappings and templates of an Elasticsearch cluster.
+
+    The cluster state is fetched and normalized once and shared by all the
+    differs of a run.
+    It can be saved to a snapshot file to diff later without a cluster.
+    """
+
+    def __init__(self, mappings, templates, created=None):
+        # normalized once, then shared read-only by all the differs
+        self.mappings = normalize_mapping(mappings)
+        self.templates = normalize_mapping(templates)
+        self.created = created or arrow.utcnow().isoformat()
+        self._catalog = None
+
+    @classmethod
+    def fetch(cls, es, mappings=True, templates=True, index_patterns=None):
+        """
+        Fetch the mappings of all the indices and/or all the templates from `es`.
+
+        See `filter_mappings` for `index_patterns`.
+        """
+        if mappings:
+            items = JSONObjectStream(iter_text(iter_mappings(es))).items()
+            mappings = filter_mappings(items, index_patterns)
+        return cls(mappings or {}, es.indices.get_template() if templates else {})
+
+    @classmethod
+    def download(cls, es, path):
+        "Save a snapshot of `es` to `path`, streaming the mappings straight into the file"
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'created': arrow.utcnow().isoformat(),
+            'templates': es.indices.get_template(),
+        }
+        with gzip.open(path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for chunk in iter_mappings(es):
+                f.write(chunk)
+
+    @classmethod
+    def load(cls, path, index_patterns=None):
+        "Load a snapshot file (see `filter_mappings` for `index_patterns`)"
+        with gzip.open(path, 'rb') as f:
+            try:
+                header = json.loads(f.readline().decode('utf-8'))
+            except ValueError:
+                header = None
+            assert isinstance(header, dict) and header.get('version') == SNAPSHOT_VERSION, (
+                INVALID_SNAPSHOT_MESSAGE.format(path=path)
+            )
+            chunks = iter_text(iter(lambda: f.read(CHUNK_SIZE), b''))
+            mappings = filter_mappings(JSONObjectStream(chunks).items(), index_patterns)
+        return cls(mappings, header['templates'], header['created'])
+
+    def save(self, path):
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'created': self.created,
+            'templates': self.templates,
+        }
+        with gzip.open(path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(json.dumps(self.mappings).encode('utf-8'))
+
+    @property
+    def catalog(self):
+        "`parsers.IndexCatalog` of the snapshot indices"
+        if self._catalog is None:
+            self._catalog = parsers.IndexCatalog(self.mappings)
+        return self._catalog
+
+    def get_template(self, name):
+        "Return the template `name` (as returned by ES, indexed by name) or None"
+        if name not in self.templates:
+            return None
+        return {name: self.templates[name]}
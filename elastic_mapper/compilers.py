@@ -0,0 +1,151 @@
+"""
+Code generation of specialized `to_representation` functions for Mapper classes.
+
+The generated function is the straight-line equivalent of the generic
+`Mapper.to_representation` loop: every field gets its own local variable,
+the builtin conversions are inlined and nested mappers are expanded in place.
+Fields with custom accessors or converters fall back to the callables stored
+in the mapper's serialization plan, bound to the mapper instance for custom
+fields (see `Mapper._get_entries`).
+"""
+from __future__ import unicode_literals
+
+import re
+
+import six
+
+from elastic_mapper.fields import (
+    BooleanField,
+    FloatField,
+    IntegerField,
+    Mapping,
+    StringField,
+    is_overridden,
+)
+
+INLINE_CONVERTERS = {
+    six.get_unbound_function(StringField.to_representation): 'text_type',
+    six.get_unbound_function(IntegerField.to_representation): 'int',
+    six.get_unbound_function(FloatField.to_representation): 'float',
+    six.get_unbound_function(BooleanField.to_representation): 'bool',
+}
+
+IDENTIFIER_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+
+class _FunctionBuilder(object):
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {
+            'Mapping': Mapping,
+            'text_type': six.text_type,
+        }
+        self.counter = 0
+
+    def local(self, prefix):
+        self.counter += 1
+        return '%s_%d' % (prefix, self.counter)
+
+    def constant(self, prefix, value):
+        name = self.local(prefix)
+        self.namespace[name] = value
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+
+def _uses_default_accessor(field):
+    return (not is_overridden(field, 'get_attribute') and
+            not is_overridden(field, 'get_accessor'))
+
+
+def _can_inline_mapper(field, mapper_base):
+    return (isinstance(field, mapper_base) and
+            not is_overridden(field, 'to_representation', mapper_base) and
+            not is_overridden(field, '_add_dynamic_data', mapper_base))
+
+
+def _emit_accessor(builder, indent, field, accessor, mapper_var, instance_var, is_mapping_var):
+    value_var = builder.local('value')
+    if not _uses_default_accessor(field):
+        accessor_name = builder.constant('accessor', accessor)
+        expression = '%s(%s, %s)' % (accessor_name, mapper_var, instance_var)
+    elif field.method and IDENTIFIER_RE.match(field.method):
+        expression = '%s.%s(%s)' % (mapper_var, field.method, instance_var)
+    elif field.method:
+        expression = 'getattr(%s, %r)(%s)' % (mapper_var, field.method, instance_var)
+    else:
+        expression = '%s[%r] if %s else getattr(%s, %r)' % (
+            instance_var, field.source, is_mapping_var, instance_var, field.source)
+    builder.emit(indent, '%s = %s' % (value_var, expression))
+    return value_var
+
+
+def _emit_mapper(builder, indent, mapper_cls, mapper_var, instance_var, result_var, mapper_base):
+    is_mapping_var = builder.local('is_mapping')
+    builder.emit(indent, '%s = {}' % result_var)
+    builder.emit(indent, '%s = isinstance(%s, Mapping)' % (is_mapping_var, instance_var))
+    plan = mapper_cls._plan
+    if plan.custom:
+        entries_var = builder.local('entries')
+        builder.emit(indent, '%s = %s._get_entries()' % (entries_var, mapper_var))
+
+    for index, (field, (field_name, accessor, converter)) in enumerate(zip(plan.fields,
+                                                                           plan.entries)):
+        if index in plan.custom:
+            # custom fields are bound to the mapper instance being serialized
+            value_var = builder.local('value')
+            builder.emit(indent, '%s = %s[%d][1](%s, %s)' % (
+                value_var, entries_var, index, mapper_var, instance_var))
+            builder.emit(indent, 'if %s is not None:' % value_var)
+            builder.emit(indent + 1, '%s = %s[%d][2](%s)' % (
+                value_var, entries_var, index, value_var))
+            builder.emit(indent, '%s[%r] = %s' % (result_var, field_name, value_var))
+            continue
+
+        value_var = _emit_accessor(builder, indent, field, accessor,
+                                   mapper_var, instance_var, is_mapping_var)
+        builder.emit(indent, 'if %s is not None:' % value_var)
+
+        converter_func = six.get_unbound_function(getattr(type(field), 'to_representation'))
+        if converter_func in INLINE_CONVERTERS:
+            builder.emit(indent + 1, '%s = %s(%s)' % (
+                value_var, INLINE_CONVERTERS[converter_func], value_var))
+        elif _can_inline_mapper(field, mapper_base):
+            # expand the nested mapper in place, using the bound field as its mapper
+            nested_mapper_var = builder.constant('mapper', field)
+            nested_result_var = builder.local('nested')
+            _emit_mapper(builder, indent + 1, type(field), nested_mapper_var,
+                         value_var, nested_result_var, mapper_base)
+            builder.emit(indent + 1, '%s = %s' % (value_var, nested_result_var))
+        else:
+            converter_name = builder.constant('converter', converter)
+            builder.emit(indent + 1, '%s = %s(%s)' % (value_var, converter_name, value_var))
+
+        builder.emit(indent, '%s[%r] = %s' % (result_var, field_name, value_var))
+
+    if mapper_cls._meta.dynamic_filter is not None:
+        builder.emit(indent, '%s = %s._add_dynamic_data(%s, %s)' % (
+            result_var, mapper_var, instance_var, result_var))
+
+
+def compile_mapper(mapper_cls):
+    """
+    Generate the specialized `(mapper, instance) -> dict` function for `mapper_cls`.
+    """
+    from elastic_mapper.mappers import Mapper
+
+    builder = _FunctionBuilder()
+    builder.emit(0, 'def to_representation(mapper, instance):')
+    _emit_mapper(builder, 1, mapper_cls, 'mapper', 'instance', 'ret', Mapper)
+    builder.emit(1, 'return ret')
+
+    source = '\n'.join(builder.lines) + '\n'
+    code = compile(source, '<compiled %s>' % mapper_cls.__name__, 'exec')
+    six.exec_(code, builder.namespace)
+
+    function = builder.namespace['to_representation']
+    function.source = source
+    return function
@@ -1,4 +1,11 @@
-from elastic_mapper import exporters
+import atexit
+import logging
+
+from elastic_mapper import dispatchers, exporters
+
+logger = logging.getLogger(__name__)
+
+INVALID_DISPATCH_MODE_MESSAGE = 'Dispatch mode `{mode}` should be one of {modes}.'
 
 
 class Config(object):
@@ -16,6 +23,36 @@ class Config(object):
         default_backend = exporters.LoggingExportBackend()
         # TODO: remove this
         self.export_backends = [default_backend, ]
+        # asyncio backends used by `TrackingService.aexport_<typename>`
+        self.async_export_backends = []
+        # serialize mappers using generated functions unless their Meta says otherwise
+        self.compiled_mappers = False
+        self.dispatcher = dispatchers.SyncDispatcher(self)
+        atexit.register(self.close)
+
+    def close(self):
+        "Flush the pending exports and close the export backends"
+        self.dispatcher.close()
+        for backend in self.export_backends:
+            try:
+                backend.close()
+            except Exception as e:
+                logger.exception(e)
+
+    def set_dispatch_mode(self, mode, **kwargs):
+        """
+        Switch between `sync` and `async` export dispatching.
+
+        Extra keyword arguments are passed to the dispatcher (e.g. `queue_size`,
+        `workers` or `overflow` for the async one). Mappers pending in the
+        previous dispatcher are flushed.
+        """
+        assert mode in dispatchers.DISPATCHERS, (
+            INVALID_DISPATCH_MODE_MESSAGE.format(mode=mode, modes=sorted(dispatchers.DISPATCHERS))
+        )
+        previous = self.dispatcher
+        self.dispatcher = dispatchers.DISPATCHERS[mode](self, **kwargs)
+        previous.close()
 
     def add_export_backend(self, backend_cls, *args, **kwargs):
         backend = backend_cls(*args, **kwargs)
@@ -23,3 +60,10 @@ class Config(object):
 
     def reset_export_backends(self):
         self.export_backends = []
+
+    def add_async_export_backend(self, backend_cls, *args, **kwargs):
+        backend = backend_cls(*args, **kwargs)
+        self.async_export_backends.append(backend)
+
+    def reset_async_export_backends(self):
+        self.async_export_backends = []
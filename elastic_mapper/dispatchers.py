@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+
+import six
+from six.moves import queue
+
+from elastic_mapper.exporters import ExportEnvelope
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+OVERFLOW_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+INVALID_OVERFLOW_MESSAGE = 'Overflow policy `{overflow}` should be one of {policies}.'
+
+# sentinel telling a worker thread to stop
+_STOP = object()
+
+
+def export_to_backends(envelope, backends):
+    "Send an export envelope to every backend, logging (and skipping) the failing ones"
+    try:
+        for backend in backends:
+            try:
+                backend.export_envelope(envelope)
+            except Exception as e:
+                logger.exception(e)
+    finally:
+        envelope.close()
+
+
+@six.add_metaclass(ABCMeta)
+class Dispatcher(object):
+
+    def __init__(self, config):
+        self.config = config
+
+    def dispatch(self, mapper, data=None):
+        """
+        Hand a mapper over to the configured export backends.
+
+        `data` is the document already mapped from the mapper instance, if any.
+        """
+        self.dispatch_envelope(ExportEnvelope(mapper, data))
+
+    @abstractmethod
+    def dispatch_envelope(self, envelope):
+        pass
+
+    def flush(self, timeout=None):
+        "Wait until every dispatched mapper has been exported"
+        pass
+
+    def close(self, timeout=None):
+        "Flush the pending mappers and release the dispatcher resources"
+        pass
+
+
+class SyncDispatcher(Dispatcher):
+    """
+    Export mappers inline on the caller's thread.
+    """
+
+    def dispatch_envelope(self, envelope):
+        export_to_backends(envelope, self.config.export_backends)
+
+
+class AsyncDispatcher(Dispatcher):
+    """
+    Export mappers from background worker threads.
+
+    Mappers are buffered in a bounded queue. When the queue is full, the
+    `overflow` policy decides what happens to new mappers:
+        - `block`: wait for a free slot (up to `block_timeout` seconds, then drop)
+        - `drop_newest`: drop the mapper being dispatched
+        - `drop_oldest`: drop the oldest queued mapper to make room
+    Pending mappers are flushed when the interpreter exits (see `Config.close`).
+
+    Mappers are serialized on the worker threads, so instances should not be
+    mutated after being exported.
+    """
+
+    def __init__(self, config, queue_size=1000, workers=1, overflow=BLOCK, block_timeout=None):
+        assert overflow in OVERFLOW_POLICIES, (
+            INVALID_OVERFLOW_MESSAGE.format(overflow=overflow, policies=OVERFLOW_POLICIES)
+        )
+        super(AsyncDispatcher, self).__init__(config)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+        self._lock = threading.Lock()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='elastic-mapper-export-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def dispatch_envelope(self, envelope):
+        if self.closed:
+            # late exports (e.g. during shutdown) are sent synchronously
+            export_to_backends(envelope, self.config.export_backends)
+            return
+
+        if self.overflow == BLOCK:
+            try:
+                self.queue.put(envelope, timeout=self.block_timeout)
+            except queue.Full:
+                self._drop()
+        elif self.overflow == DROP_NEWEST:
+            try:
+                self.queue.put_nowait(envelope)
+            except queue.Full:
+                self._drop()
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(envelope)
+                    return
+                except queue.Full:
+                    if not self._drop_oldest():
+                        # closing: the queue is left to the workers stop sentinels
+                        export_to_backends(envelope, self.config.export_backends)
+                        return
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def _drop_oldest(self):
+        "Drop the oldest queued mapper, returning False if the dispatcher is closing"
+        try:
+            oldest = self.queue.get_nowait()
+        except queue.Empty:
+            return True
+        self.queue.task_done()
+        if oldest is _STOP:
+            # never drop a worker stop sentinel queued by `close`
+            self.queue.put(oldest)
+            return False
+        self._drop()
+        return True
+
+    def _work(self):
+        while True:
+            envelope = self.queue.get()
+            try:
+                if envelope is _STOP:
+                    return
+                export_to_backends(envelope, self.config.export_backends)
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the queued mappers have been exported.
+
+        Returns False if `timeout` expired before the queue was drained.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.flush(timeout):
+            # leave the (daemon) workers behind instead of blocking the shutdown
+            return
+        for _ in self._workers:
+            self.queue.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+
+
+DISPATCHERS = {
+    'sync': SyncDispatcher,
+    'async': AsyncDispatcher,
+}
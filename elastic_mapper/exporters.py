@@ -1,8 +1,14 @@
+import collections
 import json
 import logging
+import select
+import socket
+import threading
+import time
 from abc import ABCMeta, abstractmethod
 
 import six
+from six.moves import http_client
 
 # set logging config for log based backends
 logger = logging.getLogger(__name__)
@@ -17,19 +23,343 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+MAPPER = 'mapper'
+DATA = 'data'
+JSON = 'json'
+JSON_BYTES = 'json_bytes'
+BULK_LINES = 'bulk_lines'
+
+
+class ExportEnvelope(object):
+    """
+    A mapper being exported, shared by all the export backends.
+
+    The mapped document is computed once and its encoded forms (JSON text,
+    UTF-8 bytes and `_bulk` NDJSON lines) are cached on first access, so
+    each event is mapped and encoded once regardless of the number of
+    backends. While the envelope is open, `mapper.mapped_data` also returns
+    the cached document for backends still reading it from the mapper.
+
+    `data` is the already mapped document, if any (e.g. by `Mapper.map_many`).
+    """
+
+    def __init__(self, mapper, data=None):
+        self.mapper = mapper
+        self._cache = {} if data is None else {DATA: data}
+        # nested exports of the same mapper reuse the outer envelope
+        self._attached = '_export_envelope' not in mapper.__dict__
+        if self._attached:
+            mapper._export_envelope = self
+
+    @classmethod
+    def export(cls, backend, mapper):
+        "Export a single mapper through `backend.export_envelope`"
+        envelope = cls(mapper)
+        try:
+            backend.export_envelope(envelope)
+        finally:
+            envelope.close()
+
+    def get(self, form):
+        "Return the document in the given form (`mapper`, `data`, `json`...)"
+        return getattr(self, form)
+
+    @property
+    def data(self):
+        if DATA not in self._cache:
+            outer = self.mapper.__dict__.get('_export_envelope')
+            if outer is not None and outer is not self:
+                self._cache[DATA] = outer.data
+            else:
+                self._cache[DATA] = self.mapper.to_representation(self.mapper.instance)
+        return self._cache[DATA]
+
+    @property
+    def json(self):
+        if JSON not in self._cache:
+            self._cache[JSON] = json.dumps(self.data)
+        return self._cache[JSON]
+
+    @property
+    def json_bytes(self):
+        if JSON_BYTES not in self._cache:
+            self._cache[JSON_BYTES] = self.json.encode('utf-8')
+        return self._cache[JSON_BYTES]
+
+    @property
+    def bulk_lines(self):
+        if BULK_LINES not in self._cache:
+            action = {
+                'index': {
+                    '_index': self.mapper.index,
+                    '_type': self.mapper.typename,
+                },
+            }
+            action_bytes = json.dumps(action).encode('utf-8')
+            self._cache[BULK_LINES] = b''.join([action_bytes, b'\n', self.json_bytes, b'\n'])
+        return self._cache[BULK_LINES]
+
+    def close(self):
+        "Stop serving the cached document from `mapper.mapped_data`"
+        if self._attached:
+            self.mapper.__dict__.pop('_export_envelope', None)
+            self._attached = False
+
+
 @six.add_metaclass(ABCMeta)
 class ExportBackend(object):
+    # form of the document read from the export envelope (see `ExportEnvelope`)
+    consumes = MAPPER
 
     @abstractmethod
     def export(self, mapper):
         pass
 
+    def export_envelope(self, envelope):
+        """
+        Export a document from an envelope shared with the other backends.
+
+        Backends consuming an encoded form override this method and read
+        `envelope.get(self.consumes)`; by default the mapper is exported.
+        """
+        self.export(envelope.mapper)
+
+    def close(self):
+        "Flush any buffered documents and release the backend resources"
+        pass
+
 
 class LoggingExportBackend(ExportBackend):
+    consumes = JSON
 
     def __init__(self, *args, **kwargs):
         self.indent = kwargs.pop('indent', None)
 
     def export(self, mapper):
-        data = json.dumps(mapper.mapped_data, indent=self.indent)
-        logger.info("%s: %s" % (mapper.__class__.__name__, data))
+        ExportEnvelope.export(self, mapper)
+
+    def export_envelope(self, envelope):
+        if self.indent is None:
+            data = envelope.get(self.consumes)
+        else:
+            data = json.dumps(envelope.data, indent=self.indent)
+        logger.info("%s: %s" % (envelope.mapper.__class__.__name__, data))
+
+
+BulkResult = collections.namedtuple('BulkResult', ['indexed', 'failures'])
+BulkFailure = collections.namedtuple('BulkFailure', ['index', 'typename', 'status', 'error'])
+
+
+class BulkExportError(Exception):
+    pass
+
+
+def parse_bulk_response(status, data, on_failure=None):
+    """
+    Turn a `_bulk` response into a `BulkResult`.
+
+    Rejected documents are logged and passed to the `on_failure` callback.
+    """
+    if status >= 300:
+        raise BulkExportError('Bulk request failed with status %s: %s' % (status, data))
+
+    indexed = 0
+    failures = []
+    for item in json.loads(data.decode('utf-8')).get('items', []):
+        action, info = list(item.items())[0]
+        if 'error' not in info and info.get('status', 200) < 300:
+            indexed += 1
+            continue
+        failure = BulkFailure(index=info.get('_index'),
+                              typename=info.get('_type'),
+                              status=info.get('status'),
+                              error=info.get('error'))
+        failures.append(failure)
+        logger.error("Bulk %s into %s failed: %s" % (action, failure.index, failure.error))
+        if on_failure:
+            on_failure(failure)
+    return BulkResult(indexed=indexed, failures=failures)
+
+
+def report_failed_batch(body, error, on_failure=None):
+    """
+    Log a `_bulk` body whose request failed and pass each of its documents to
+    the `on_failure` callback, so failed batches are not silently lost.
+    """
+    lines = body.splitlines()
+    logger.error("Bulk request of %d documents failed: %s" % (len(lines) // 2, error))
+    if not on_failure:
+        return
+    for action_line in lines[::2]:
+        action, info = list(json.loads(action_line.decode('utf-8')).items())[0]
+        on_failure(BulkFailure(index=info.get('_index'),
+                               typename=info.get('_type'),
+                               status=None,
+                               error=str(error)))
+
+
+def is_connection_dropped(connection):
+    "Whether the server closed the idle kept-alive `connection`"
+    if connection.sock is None:
+        # not connected (yet), `request` opens a new socket
+        return False
+    return is_socket_dropped(connection.sock)
+
+
+def is_socket_dropped(sock):
+    "Whether the server closed the idle kept-alive socket `sock`"
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (ValueError, select.error):
+        return True
+    # an idle connection is only readable when the server closed it
+    return bool(readable)
+
+
+class BulkExportBackend(ExportBackend):
+    """
+    Index documents in Elasticsearch using the `_bulk` API.
+
+    Documents are buffered as NDJSON and sent in a single request when any of
+    these limits is reached:
+        - `max_docs` buffered documents
+        - `max_bytes` of buffered NDJSON
+        - `max_latency` seconds since the oldest buffered document (checked on
+          every export and by a background timer)
+    Requests reuse one keep-alive HTTP connection. Documents rejected by
+    Elasticsearch, or of batches whose request failed, are logged and passed
+    to the `on_failure` callback.
+    """
+    consumes = BULK_LINES
+
+    def __init__(self, host='localhost', port=9200, max_docs=500, max_bytes=5 * 1024 * 1024,
+                 max_latency=1.0, timeout=10, on_failure=None):
+        self.host = host
+        self.port = port
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.timeout = timeout
+        self.on_failure = on_failure
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffered_at = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._connection = None
+
+        self._stopped = threading.Event()
+        self._timer = None
+        if max_latency:
+            self._timer = threading.Thread(target=self._flush_periodically,
+                                           name='elastic-mapper-bulk-flush')
+            self._timer.daemon = True
+            self._timer.start()
+
+    def export(self, mapper):
+        ExportEnvelope.export(self, mapper)
+
+    def export_envelope(self, envelope):
+        self.add_lines(envelope.get(self.consumes))
+
+    def add_lines(self, lines):
+        "Buffer an encoded `_bulk` action/document pair, flushing when a limit is reached"
+        with self._lock:
+            if not self._buffer:
+                self._buffered_at = time.time()
+            self._buffer.append(lines)
+            self._buffer_bytes += len(lines)
+            if not self._is_due():
+                return
+            body = self._take_buffer()
+        self._send(body)
+
+    def _is_due(self):
+        return (len(self._buffer) >= self.max_docs or
+                self._buffer_bytes >= self.max_bytes or
+                bool(self.max_latency and time.time() - self._buffered_at >= self.max_latency))
+
+    def _take_buffer(self):
+        body = b''.join(self._buffer)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffered_at = None
+        return body
+
+    def flush(self):
+        """
+        Send the buffered documents.
+
+        Returns a `BulkResult` with the number of indexed documents and the
+        list of per-item failures.
+        """
+        with self._lock:
+            if not self._buffer:
+                return BulkResult(indexed=0, failures=[])
+            body = self._take_buffer()
+        return self._send(body)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.max_latency):
+            with self._lock:
+                if not self._buffer or not self._is_due():
+                    continue
+                body = self._take_buffer()
+            try:
+                self._send(body)
+            except Exception as e:
+                logger.exception(e)
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+        with self._send_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _get_connection(self, reconnect=False):
+        if self._connection is not None and (reconnect or
+                                             is_connection_dropped(self._connection)):
+            self._connection.close()
+            self._connection = None
+        if self._connection is None:
+            self._connection = http_client.HTTPConnection(self.host, self.port,
+                                                          timeout=self.timeout)
+        return self._connection
+
+    def _request(self, body):
+        headers = {'Content-Type': 'application/x-ndjson'}
+        connection = self._get_connection()
+        reused = connection.sock is not None
+        try:
+            try:
+                connection.request('POST', '/_bulk', body, headers)
+            except (http_client.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # the kept-alive connection failed while sending the request,
+                # before Elasticsearch could process it, so send it on a new one
+                connection = self._get_connection(reconnect=True)
+                connection.request('POST', '/_bulk', body, headers)
+            # never retried once sent, Elasticsearch may have indexed the batch
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (http_client.HTTPException, socket.error):
+            connection.close()
+            self._connection = None
+            raise
+
+    def _send(self, body):
+        with self._send_lock:
+            try:
+                status, data = self._request(body)
+            except (http_client.HTTPException, socket.error) as e:
+                report_failed_batch(body, e, self.on_failure)
+                raise
+        try:
+            return parse_bulk_response(status, data, self.on_failure)
+        except BulkExportError as e:
+            report_failed_batch(body, e, self.on_failure)
+            raise
@@ -1,19 +1,39 @@
 from __future__ import unicode_literals
 
 import arrow
-import collections
 import six
 
-from elastic_mapper import repr_utils
+from elastic_mapper import formatters, repr_utils
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python 2
+    from collections import Mapping
 
 
 def get_attribute(obj, attr):
-    if isinstance(obj, collections.Mapping):
+    if isinstance(obj, Mapping):
         return obj[attr]
     else:
         return getattr(obj, attr)
 
 
+def is_overridden(field, method_name, base=None):
+    """Check whether the class of `field` overrides `method_name` from `base` (`Field`)."""
+    base = base or Field
+    method = six.get_unbound_function(getattr(type(field), method_name))
+    return method is not six.get_unbound_function(getattr(base, method_name))
+
+
+def is_custom_field(field):
+    """Check whether `field` serializes with methods defined outside elastic_mapper."""
+    for method_name in ('get_attribute', 'get_accessor', 'to_representation'):
+        method = six.get_unbound_function(getattr(type(field), method_name))
+        if not method.__module__.startswith('elastic_mapper.'):
+            return True
+    return False
+
+
 NOT_SOURCE_AND_METHOD_MESSAGE = 'May not set both `source` and `method` attributes simultaneously'
 WRONG_OPTION_TYPE_MESSAGE = ('Parameter `{param}` for field of type `{field_class}` '
                              'should be a `{type}`.')
@@ -68,10 +88,18 @@ class Field(object):
                 self.params[kw] = value
 
     def bind(self, field_name, mapper):
+        """
+        Bind the field to its name and owning mapper.
+
+        Fields are bound to the mapper class once, when the class is created,
+        and shared read-only by every instance of that class. `Mapper.fields`
+        and custom fields (see `is_custom_field`) are bound again to the mapper
+        instance being serialized.
+        """
         assert self.method or self.source != field_name, (
             "Remove the redundant `source='%s'` keyword argument "
             "in mapper '%s' as it matches the field name '%s'." %
-            (self.source, mapper.__class__.__name__, field_name)
+            (self.source, mapper.__name__, field_name)
         )
 
         self.field_name = field_name
@@ -89,6 +117,32 @@ class Field(object):
         # obtain attribute from instance using the given source
         return get_attribute(instance, self.source)
 
+    def get_accessor(self):
+        """
+        Return a `(mapper, instance) -> value` callable resolving the field value.
+
+        The accessor is resolved once per mapper class and receives the mapper
+        instance being serialized, so `method` fields are looked up on it.
+        Fields overriding `get_attribute` only are called through it instead.
+        """
+        if is_overridden(self, 'get_attribute') and not is_overridden(self, 'get_accessor'):
+            get_field_attribute = self.get_attribute
+
+            def accessor(mapper, instance):
+                return get_field_attribute(instance)
+        elif self.method:
+            method_name = self.method
+
+            def accessor(mapper, instance):
+                return getattr(mapper, method_name)(instance)
+        else:
+            source = self.source
+
+            def accessor(mapper, instance):
+                return get_attribute(instance, source)
+
+        return accessor
+
     def to_representation(self, value):
         raise NotImplementedError("A Field must implement the to_representation method")
 
@@ -174,6 +228,7 @@ class DateField(Field):
         self.auto_now = kwargs.pop('auto_now', False)
         # Arrow datetime format
         self.strftime = kwargs.pop('strftime', 'YYYY-MM-DDTHH:mm:ss.SSSZ')
+        self.formatter = formatters.compile_format(self.strftime)
         super(DateField, self).__init__(**kwargs)
 
     def get_attribute(self, instance):
@@ -185,9 +240,17 @@ class DateField(Field):
         # obtain datetime from source
         return super(DateField, self).get_attribute(instance)
 
+    def get_accessor(self):
+        if not self.auto_now:
+            # resolve the source or method accessor from the base field
+            return super(DateField, self).get_accessor()
+
+        def accessor(mapper, instance):
+            return arrow.now()
+        return accessor
+
     def to_representation(self, value):
-        v = arrow.get(value)
-        return v.format(self.strftime)
+        return self.formatter(value)
 
     @property
     def mapping_data(self):
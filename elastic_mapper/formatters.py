@@ -0,0 +1,163 @@
+"""
+Precompiled date formatters producing the same output as `Arrow.format`.
+
+Arrow parses the format string and dispatches every token on each call. Here
+the format is tokenized once into a single `%` template and the functions
+reading its arguments from the `datetime` (e.g. `YYYY-MM-DD` becomes
+`'%04d-%02d-%02d'` filled with `dt.year`, `dt.month` and `dt.day`). Locale
+dependent and epoch tokens (`MMMM`, `dddd`, `a`, `X`...) are formatted one by
+one with Arrow's public `DateTimeFormatter.format`, so their output does not
+depend on the Arrow version.
+
+Values are converted to an aware `datetime` without building `Arrow` objects
+for the common types (datetimes and epoch numbers); anything else goes
+through `arrow.get`.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import operator
+import re
+
+import arrow
+import six
+from arrow.formatter import DateTimeFormatter
+
+try:
+    from arrow.util import normalize_timestamp
+except ImportError:  # arrow < 0.15 does not normalize ms/us timestamps
+    def normalize_timestamp(timestamp):
+        return timestamp
+
+# the UTC tzinfo used by `arrow.get` for naive datetimes and timestamps
+UTC = arrow.get(0).tzinfo
+
+# the format tokens understood by `Arrow.format`, kept here instead of relying on
+# the private `DateTimeFormatter._FORMAT_RE`; tokens unknown to the installed
+# Arrow version are handed to its formatter, which leaves them as they are
+FORMAT_RE = re.compile(
+    r'(\[[^]]*\]|YYY?Y?|MM?M?M?|Do|DD?D?D?|d?dd?d?|HH?|hh?|mm?|ss?|SS?S?S?S?S?|'
+    r'ZZ?Z?|a|A|X|x|W)'
+)
+
+
+def _hour_12(dt):
+    return dt.hour if 0 < dt.hour < 13 else abs(dt.hour - 12)
+
+
+# token -> (% directive, function of `dt`)
+INLINE_TOKENS = {
+    'YYYY': ('%04d', operator.attrgetter('year')),
+    'YY': ('%s', lambda dt: ('%04d' % dt.year)[2:]),
+    'MM': ('%02d', operator.attrgetter('month')),
+    'M': ('%d', operator.attrgetter('month')),
+    'DDDD': ('%03d', lambda dt: dt.timetuple().tm_yday),
+    'DDD': ('%d', lambda dt: dt.timetuple().tm_yday),
+    'DD': ('%02d', operator.attrgetter('day')),
+    'D': ('%d', operator.attrgetter('day')),
+    'd': ('%d', lambda dt: dt.isoweekday()),
+    'HH': ('%02d', operator.attrgetter('hour')),
+    'H': ('%d', operator.attrgetter('hour')),
+    'hh': ('%02d', _hour_12),
+    'h': ('%d', _hour_12),
+    'mm': ('%02d', operator.attrgetter('minute')),
+    'm': ('%d', operator.attrgetter('minute')),
+    'ss': ('%02d', operator.attrgetter('second')),
+    's': ('%d', operator.attrgetter('second')),
+    'SSSSSS': ('%06d', operator.attrgetter('microsecond')),
+    'SSSSS': ('%05d', lambda dt: dt.microsecond // 10),
+    'SSSS': ('%04d', lambda dt: dt.microsecond // 100),
+    'SSS': ('%03d', lambda dt: dt.microsecond // 1000),
+    'SS': ('%02d', lambda dt: dt.microsecond // 10000),
+    'S': ('%d', lambda dt: dt.microsecond // 100000),
+    'ZZ': ('%s', lambda dt: format_offset(dt, ':')),
+    'Z': ('%s', lambda dt: format_offset(dt, '')),
+}
+
+_token_formatter = DateTimeFormatter()
+_formatters = {}
+_offsets = {}
+
+
+def format_offset(dt, separator):
+    "Format the UTC offset of `dt` as `+HHMM` (or `+HH:MM`)"
+    key = (dt.utcoffset(), separator)
+    offset = _offsets.get(key)
+    if offset is None:
+        total_minutes = int(key[0].total_seconds() / 60)
+        sign = '+' if total_minutes >= 0 else '-'
+        hour, minute = divmod(abs(total_minutes), 60)
+        offset = _offsets[key] = '%s%02d%s%02d' % (sign, hour, separator, minute)
+    return offset
+
+
+def to_datetime(value):
+    """
+    Convert `value` to an aware `datetime` the way `arrow.get(value)` does.
+
+    Naive datetimes and epoch numbers (seconds, milliseconds or microseconds)
+    are taken as UTC.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=UTC)
+        return value
+    if isinstance(value, arrow.Arrow):
+        return value.datetime
+    if isinstance(value, (float,) + six.integer_types) and not isinstance(value, bool):
+        return datetime.datetime.fromtimestamp(normalize_timestamp(float(value)), UTC)
+    return arrow.get(value).datetime
+
+
+def _compile_template(fmt):
+    template = []
+    getters = []
+
+    position = 0
+    for match in FORMAT_RE.finditer(fmt):
+        template.append(fmt[position:match.start()].replace('%', '%%'))
+        position = match.end()
+
+        token = match.group(0)
+        if token.startswith('[') and token.endswith(']'):
+            template.append(token[1:-1].replace('%', '%%'))
+        elif token in INLINE_TOKENS:
+            directive, getter = INLINE_TOKENS[token]
+            template.append(directive)
+            getters.append(getter)
+        else:
+            template.append('%s')
+            getters.append(_token_function(token))
+    template.append(fmt[position:].replace('%', '%%'))
+
+    template = ''.join(template)
+    if not getters:
+        return lambda dt: template % ()
+    if len(getters) == 1:
+        getter = getters[0]
+        return lambda dt: template % (getter(dt), )
+    return lambda dt: template % tuple([getter(dt) for getter in getters])
+
+
+def _token_function(token):
+    def format_token(dt):
+        return _token_formatter.format(dt, token)
+    return format_token
+
+
+def compile_format(fmt):
+    """
+    Return a `value -> text` function equivalent to `arrow.get(value).format(fmt)`.
+
+    Compiled formatters are cached by format string.
+    """
+    formatter = _formatters.get(fmt)
+    if formatter is None:
+        format_datetime = _compile_template(fmt)
+
+        def formatter(value):
+            return format_datetime(to_datetime(value))
+
+        formatter.format_datetime = format_datetime
+        _formatters[fmt] = formatter
+    return formatter
@@ -0,0 +1,152 @@
+"""
+Read-only mappings shared instead of copied.
+
+Generated mappings and templates are built once per class and returned to
+every caller, and the CLI differs share the (normalized) cluster mappings,
+so none of them may be modified in place.
+"""
+import collections
+import hashlib
+import json
+import sys
+
+import six
+
+FROZEN_MESSAGE = 'Frozen mappings are shared and may not be modified.'
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(FROZEN_MESSAGE)
+
+
+if sys.version_info >= (3, 7):
+    _OrderedDict = dict  # dicts keep the insertion order
+else:
+    _OrderedDict = collections.OrderedDict
+
+
+class FrozenMapping(_OrderedDict):
+    """
+    Read-only dict keeping the insertion order, returned as is when copied.
+
+    It compares like a dict; `copy()` returns a mutable (shallow)
+    `OrderedDict`, see also `thaw`.
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = move_to_end = _read_only
+
+    __eq__ = dict.__eq__
+    __ne__ = dict.__ne__
+    __hash__ = None
+
+    if _OrderedDict is not dict:
+        def __init__(self, *args, **kwargs):
+            # `OrderedDict.__init__` would go through the read-only `__setitem__`
+            collections.OrderedDict.__init__(self)
+            for key, value in six.iteritems(collections.OrderedDict(*args, **kwargs)):
+                collections.OrderedDict.__setitem__(self, key, value)
+
+    def copy(self):
+        return collections.OrderedDict(self)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (list(six.iteritems(self)), ))
+
+
+class FrozenList(list):
+    "Read-only list, returned as is when copied"
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = sort = reverse = clear = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (list(self), ))
+
+
+def freeze(value):
+    "Return a read-only copy of `value`, converting nested dicts and lists"
+    if isinstance(value, (FrozenMapping, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenMapping((k, freeze(v)) for k, v in six.iteritems(value))
+    if isinstance(value, (list, tuple)):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    "Return a mutable deep copy of `value`, converting frozen mappings and lists"
+    if isinstance(value, dict):
+        return collections.OrderedDict((k, thaw(v)) for k, v in six.iteritems(value))
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+
+def canonical_json(value):
+    "JSON of `value` with sorted keys and no whitespace, so equal mappings have equal JSON"
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+class GeneratedMapping(object):
+    """
+    Frozen result of `Mapper.generate_mapping` or `Template.generate_template`.
+
+    Its canonical JSON and hash are computed on first use.
+    """
+    __slots__ = ('data', '_json', '_hash')
+
+    def __init__(self, data):
+        self.data = freeze(data)
+        self._json = None
+        self._hash = None
+
+    @property
+    def json(self):
+        if self._json is None:
+            self._json = canonical_json(self.data)
+        return self._json
+
+    @property
+    def hash(self):
+        "sha1 hex digest of the canonical JSON"
+        if self._hash is None:
+            self._hash = hashlib.sha1(self.json.encode('utf-8')).hexdigest()
+        return self._hash
+
+
+def get_generated(cls, attr, generate):
+    """
+    Return the `GeneratedMapping` cached as `attr` on `cls` itself.
+
+    The cache is not inherited, so it is built with `generate()` on first use
+    for every class.
+    """
+    generated = cls.__dict__.get(attr)
+    if generated is None:
+        generated = GeneratedMapping(generate())
+        setattr(cls, attr, generated)
+    return generated
+
+
+def clear_generated(cls, attr):
+    "Drop the `attr` cache of `cls` and its subclasses, which may inherit what changed"
+    if attr in cls.__dict__:
+        delattr(cls, attr)
+    for subclass in cls.__subclasses__():
+        clear_generated(subclass, attr)
@@ -1,26 +1,101 @@
 from __future__ import unicode_literals
+import collections
 import copy
 
 import six
 
-from elastic_mapper import repr_utils
-from elastic_mapper.loggers import global_logger
+from elastic_mapper import compilers, config, frozen_mappings, repr_utils, samplers
 
 from elastic_mapper.fields import (  # flake8: noqa # isort:skip
-    get_attribute,
     Field,
     StringField,
     BooleanField,
     IntegerField,
     FloatField,
     DateField,
+    is_custom_field,
 )
 
 
+ALL_FIELDS = '__all__'
+PREFIX_WILDCARD = '*'
+EXPORT_STREAM_CHUNK_SIZE = 500
+
+
 class MapperOptions(object):
 
-    def __init__(self, dynamic_fields):
+    def __init__(self, dynamic_fields, exclude_dynamic_fields=(), compiled=None, sampling=None):
         self.dynamic_fields = dynamic_fields
+        self.exclude_dynamic_fields = exclude_dynamic_fields
+        # None: use the global `Config.compiled_mappers` switch
+        self.compiled = compiled
+        # `samplers.OPTIONS` set for the mapper type
+        self.sampling = sampling or {}
+        # `samplers.Sampler` deciding which events are exported, if any
+        self.sampler = samplers.Sampler.from_options(self.sampling)
+        # set by the metaclass once the mapper fields are bound
+        self.dynamic_filter = None
+
+
+def _split_patterns(patterns):
+    "Split field patterns into a frozenset of names and a tuple of prefixes (`prefix*`)"
+    names = frozenset(p for p in patterns if not p.endswith(PREFIX_WILDCARD))
+    prefixes = tuple(p[:-len(PREFIX_WILDCARD)] for p in patterns if p.endswith(PREFIX_WILDCARD))
+    return names, prefixes
+
+
+class DynamicFieldsFilter(object):
+    """
+    Decide which instance attributes are exported as dynamic fields.
+
+    Allowed and denied names are precomputed into frozensets once per mapper
+    class, so checking an attribute does not depend on the number of fields.
+    Patterns ending with `*` match attribute name prefixes.
+    """
+
+    def __init__(self, dynamic_fields, exclude_dynamic_fields, fields):
+        self.allow_all = dynamic_fields == ALL_FIELDS
+        if self.allow_all:
+            dynamic_fields = ()
+        self.allowed, self.allowed_prefixes = _split_patterns(dynamic_fields)
+        denied, self.denied_prefixes = _split_patterns(exclude_dynamic_fields)
+
+        # attributes already consumed by declared fields are never dynamic
+        skipped = set(denied)
+        for field in fields:
+            skipped.add(field.field_name)
+            if field.source and not field.source.startswith('mapper__'):
+                skipped.add(field.source)
+        self.skipped = frozenset(skipped)
+
+    def is_dynamic(self, attr):
+        if attr in self.skipped:
+            return False
+        is_text = isinstance(attr, six.string_types)
+        if self.denied_prefixes and is_text and attr.startswith(self.denied_prefixes):
+            return False
+        if self.allow_all or attr in self.allowed:
+            return True
+        return bool(self.allowed_prefixes) and is_text and attr.startswith(self.allowed_prefixes)
+
+
+# Immutable serialization plan built once per mapper class:
+#   - fields: bound copies of the declared fields, shared by all the mapper instances
+#   - entries: `(field_name, accessor, converter)` tuples driving `to_representation`
+#   - custom: indexes of the custom fields, whose entries are bound to every mapper
+#     instance (see `Mapper._get_entries`)
+MapperPlan = collections.namedtuple('MapperPlan', ['fields', 'entries', 'custom'])
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 class MapperMetaclass(type):
@@ -46,15 +121,48 @@ class MapperMetaclass(type):
     def __init__(cls, name, bases, attrs):
         # set _meta options
         dynamic_fields = ()
+        exclude_dynamic_fields = ()
+        compiled = None
+        sampling = None
         meta = getattr(cls, 'Meta', None)
         if meta:
             # override defaults from SyncController's Meta
             dynamic_fields = getattr(meta, 'dynamic_fields', dynamic_fields)
+            exclude_dynamic_fields = getattr(meta, 'exclude_dynamic_fields',
+                                             exclude_dynamic_fields)
+            compiled = getattr(meta, 'compiled', compiled)
+            sampling = dict((name, getattr(meta, name)) for name in samplers.OPTIONS
+                            if getattr(meta, name, None) is not None)
 
         # create _meta attribute containing the Mapper's options
-        options = MapperOptions(dynamic_fields=dynamic_fields)
+        options = MapperOptions(dynamic_fields=dynamic_fields,
+                                exclude_dynamic_fields=exclude_dynamic_fields,
+                                compiled=compiled,
+                                sampling=sampling)
         setattr(cls, '_meta', options)
 
+        # build the serialization plan shared by all the instances of the class
+        setattr(cls, '_plan', cls._build_plan())
+        if dynamic_fields:
+            options.dynamic_filter = DynamicFieldsFilter(dynamic_fields,
+                                                         exclude_dynamic_fields,
+                                                         cls._plan.fields)
+
+    def _build_plan(cls):
+        fields = []
+        entries = []
+        custom = []
+        for field_name, declared_field in six.iteritems(cls._declared_fields):
+            # copy the declared field since it may be shared with parent classes
+            field = copy.deepcopy(declared_field)
+            field.bind(field_name, cls)
+            if is_custom_field(field):
+                custom.append(len(fields))
+            fields.append(field)
+            entries.append((field_name, field.get_accessor(), field.to_representation))
+
+        return MapperPlan(fields=tuple(fields), entries=tuple(entries), custom=tuple(custom))
+
 
 @six.add_metaclass(MapperMetaclass)
 class Mapper(Field):
@@ -66,51 +174,181 @@ class Mapper(Field):
     @property
     def fields(self):
         """
+        Fields bound to this mapper instance, copied on first access from the
+        fields of the mapper class (see `_plan`).
         """
-        if not hasattr(self, '_fields'):
-            self._fields = {}
-            for field_name, field in self.copied_fields().items():
-                field.bind(field_name, self)
-                self._fields[field_name] = field
+        fields = self.__dict__.get('_fields')
+        if fields is None:
+            fields = self._fields = tuple(self._bind_field(field) for field in self._plan.fields)
+        return fields
 
-        return self._fields.values()
+    def _bind_field(self, field):
+        bound_field = copy.copy(field)
+        bound_field.mapper = self
+        return bound_field
 
-    def copied_fields(self):
-        return copy.deepcopy(self._declared_fields)
+    def _get_entries(self):
+        """
+        Return the serialization plan entries, with the custom fields (which may
+        read their `mapper`) bound to this mapper instance on first use.
+        """
+        plan = self._plan
+        if not plan.custom:
+            return plan.entries
+        entries = self.__dict__.get('_entries')
+        if entries is None:
+            entries = list(plan.entries)
+            for index in plan.custom:
+                field = self._bind_field(plan.fields[index])
+                entries[index] = (field.field_name, field.get_accessor(), field.to_representation)
+            entries = self._entries = tuple(entries)
+        return entries
+
+    @classmethod
+    def is_compiled(cls):
+        "Whether the mapper is serialized with a generated `to_representation` function"
+        if cls._meta.compiled is None:
+            return config.Config().compiled_mappers
+        return cls._meta.compiled
+
+    @classmethod
+    def get_compiled_function(cls):
+        """
+        Return the `(mapper, instance) -> dict` function generated for this class.
+
+        The function is generated on first use and cached on the class.
+        """
+        function = cls.__dict__.get('_compiled_function')
+        if function is None:
+            function = compilers.compile_mapper(cls)
+            setattr(cls, '_compiled_function', staticmethod(function))
+        else:
+            function = function.__func__
+        return function
 
     def to_representation(self, instance):
+        if self.is_compiled():
+            return self.get_compiled_function()(self, instance)
+
         ret = dict()
 
         # mapped data
-        for field in self.fields:
-            value = field.get_attribute(instance)
+        for field_name, accessor, converter in self._get_entries():
+            value = accessor(self, instance)
             if value is not None:
-                value = field.to_representation(value)
-            ret[field.field_name] = value
+                value = converter(value)
+            ret[field_name] = value
+
+        return self._add_dynamic_data(instance, ret)
+
+    def _add_dynamic_data(self, instance, ret):
+        dynamic_filter = self._meta.dynamic_filter
+        if dynamic_filter is None:
+            return ret
 
-        # dynamic data
         attrs = getattr(instance, '__dict__', instance)
         if not attrs:
             return ret
 
+        # TODO: recursively assert type correctness
+        is_dynamic = dynamic_filter.is_dynamic
         for attr, value in six.iteritems(attrs):
-            if not(self._meta.dynamic_fields == '__all__' or attr in self._meta.dynamic_fields):
-                # skip when this attribute is not allowed to be dynamic
-                continue
-
-            # TODO: recursively assert type correctness
-            skip_attrs = (f.field_name
-                          if (not f.source or f.source.startswith('mapper__'))
-                          else f.source
-                          for f in self.fields)
-            if attr not in skip_attrs:
-                ret[attr] = get_attribute(instance, attr)
+            if is_dynamic(attr):
+                ret[attr] = value
 
         return ret
 
+    @classmethod
+    def map_many(cls, iterable, chunk_size=None):
+        """
+        Map every object in `iterable` reusing a single mapper instance.
+
+        Returns a generator of mapped documents or, when `chunk_size` is given,
+        a generator of lists with up to `chunk_size` mapped documents.
+        """
+        documents = cls()._map_many(iterable)
+        if not chunk_size:
+            return documents
+        return _chunks(documents, chunk_size)
+
+    def _map_many(self, iterable):
+        if self.is_compiled():
+            to_representation = self.get_compiled_function()
+            for instance in iterable:
+                self.instance = instance
+                yield to_representation(self, instance)
+            return
+
+        # hoist all the lookups out of the loop
+        entries = self._get_entries()
+        add_dynamic_data = self._add_dynamic_data if self._meta.dynamic_filter else None
+
+        for instance in iterable:
+            self.instance = instance
+            ret = {}
+            for field_name, accessor, converter in entries:
+                value = accessor(self, instance)
+                if value is not None:
+                    value = converter(value)
+                ret[field_name] = value
+
+            if add_dynamic_data is not None:
+                ret = add_dynamic_data(instance, ret)
+            yield ret
+
     def export(self):
-        "Sends the mapped data to the configured export backends"
-        global_logger.info('export', self)
+        """
+        Sends the mapped data to the configured export backends.
+
+        Events dropped by the type sampler (see `samplers`) are not mapped.
+        """
+        sampler = self._meta.sampler
+        if sampler is not None and not sampler.allow(self.instance):
+            return
+        config.Config().dispatcher.dispatch(self)
+
+    @classmethod
+    def export_many(cls, iterable):
+        """
+        Export every object in `iterable`, mapping them in a batch (see `map_many`).
+
+        Returns the number of exported objects, without the ones dropped by the
+        type sampler.
+        """
+        return cls._export_batch(iterable, config.Config().dispatcher)
+
+    @classmethod
+    def export_stream(cls, iterable, chunk_size=EXPORT_STREAM_CHUNK_SIZE):
+        """
+        Export the objects of a (possibly endless) `iterable` in chunks of `chunk_size`.
+
+        The dispatcher is flushed after every chunk, so no more than one chunk
+        is waiting to be exported. Returns the number of exported objects.
+        """
+        dispatcher = config.Config().dispatcher
+        count = 0
+        for chunk in _chunks(iterable, chunk_size):
+            count += cls._export_batch(chunk, dispatcher)
+            dispatcher.flush()
+        return count
+
+    @classmethod
+    def _export_batch(cls, iterable, dispatcher):
+        if cls._meta.sampler is not None:
+            iterable = cls._meta.sampler.filter(iterable)
+        batch_mapper = cls()
+        state = dict(batch_mapper.__dict__)
+        dispatch = dispatcher.dispatch
+        count = 0
+        for data in batch_mapper._map_many(iterable):
+            # every export gets its own mapper, since dispatchers may export it
+            # later; it is cloned from the batch mapper instead of initialized
+            mapper = object.__new__(cls)
+            mapper.__dict__.update(state)
+            mapper.instance = batch_mapper.instance
+            dispatch(mapper, data)
+            count += 1
+        return count
 
     @property
     def index(self):
@@ -121,6 +359,10 @@ class Mapper(Field):
         """
         Object instance -> Dict of primitive datatypes.
         """
+        # served from the export envelope while the mapper is being exported
+        envelope = self.__dict__.get('_export_envelope')
+        if envelope is not None:
+            return envelope.data
         return self.to_representation(self.instance)
 
     @property
@@ -129,12 +371,12 @@ class Mapper(Field):
             'type': 'object',
             'properties': {},
         }
-        for field in self.fields:
+        for field in self._plan.fields:
             mapping['properties'][field.field_name] = field.mapping_data
         return mapping
 
     @classmethod
-    def generate_mapping(cls):
+    def _generate_mapping(cls):
         properties = {}
         for attr_name, field in six.iteritems(cls._declared_fields):
             properties[attr_name] = field.mapping_data
@@ -146,5 +388,33 @@ class Mapper(Field):
         }
         return mapping
 
+    @classmethod
+    def _get_generated_mapping(cls):
+        return frozen_mappings.get_generated(cls, '_generated_mapping', cls._generate_mapping)
+
+    @classmethod
+    def generate_mapping(cls):
+        """
+        Elasticsearch mapping of the mapper type.
+
+        Generated once per class and returned frozen; `templates.register`
+        clears it.
+        """
+        return cls._get_generated_mapping().data
+
+    @classmethod
+    def get_mapping_json(cls):
+        "Canonical JSON of `generate_mapping`"
+        return cls._get_generated_mapping().json
+
+    @classmethod
+    def get_mapping_hash(cls):
+        "Stable hash of `generate_mapping`"
+        return cls._get_generated_mapping().hash
+
+    @classmethod
+    def clear_generated_mapping(cls):
+        frozen_mappings.clear_generated(cls, '_generated_mapping')
+
     def __repr__(self):
         return repr_utils.mapper_repr(self)
@@ -1,29 +1,98 @@
+import bisect
+import calendar
+import operator
+import time
 from abc import ABCMeta, abstractmethod
 
 import six
 import re
 
 import arrow
+from arrow.formatter import DateTimeFormatter
 
+from elastic_mapper import formatters
 from elastic_mapper.fields import get_attribute
 
 
-def get_matching_indexes(key, mappings):
-    """Get the list of Elasticsearch indices that match the timely pattern given by `key`."""
-    # TODO: add unit test for this
-    # TODO: consider matching using versioning (e.g. index-prefix-{version}-{time})
-    pattern = re.compile(r"(?<=\{)(.*?)(?=\})")
-    matches = pattern.findall(key)
-    for match in matches:
-        key = key.replace('{' + match + '}', "\\w")
+PLACEHOLDER_RE = re.compile(r"\{.*?\}")
+
+# largest character sorting after any index name with a given prefix
+_MAX_CHAR = u'\uffff'
+
+_index_patterns = {}
+
+
+def compile_index_pattern(key):
+    """
+    Compile the index name pattern `key` (e.g. `index-prefix-{time}`) into a regex.
+
+    Placeholders match a non-empty word, and the regex is matched at the start
+    of index names. Compiled patterns are cached by key.
+    """
+    pattern = _index_patterns.get(key)
+    if pattern is None:
+        literals = PLACEHOLDER_RE.split(key)
+        pattern = re.compile(r'\w+'.join(re.escape(literal) for literal in literals))
+        _index_patterns[key] = pattern
+    return pattern
+
+
+class IndexCatalog(object):
+    """
+    Sorted catalog of the index names of a cluster.
+
+    Build it once per cluster snapshot and reuse it to match many index
+    patterns: the names sharing the literal prefix of a pattern are found by
+    binary search, so matching costs about the number of candidate names
+    rather than the number of indices in the cluster.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        i = bisect.bisect_left(self.names, name)
+        return i < len(self.names) and self.names[i] == name
+
+    def with_prefix(self, prefix, start=None, end=None):
+        """
+        Get the index names starting with `prefix`.
+
+        `start` and `end` restrict the text following the prefix to an
+        inclusive range, compared as prefixes (e.g. `end='201601'` includes
+        `20160131`).
+        """
+        low = prefix + (start or '')
+        high = prefix + (end or '') + _MAX_CHAR
+        return self.names[bisect.bisect_left(self.names, low):
+                          bisect.bisect_right(self.names, high)]
+
+    def match(self, key, start=None, end=None):
+        """
+        Get the index names matching the pattern `key`, in sorted order.
+
+        `start` and `end` restrict the time component following the literal
+        prefix of `key` (see `with_prefix`), e.g. `'20160101'` to `'20160131'`
+        for daily indices.
+        """
+        prefix = PLACEHOLDER_RE.split(key, 1)[0]
+        pattern = compile_index_pattern(key)
+        return [name for name in self.with_prefix(prefix, start, end) if pattern.match(name)]
 
-    repl = re.compile(key)
-    matches = []
-    for key in mappings.keys():
-        if repl.match(key):
-            matches.append(key)
 
-    return matches
+def get_matching_indexes(key, mappings):
+    """
+    Get the list of Elasticsearch indices that match the timely pattern given by `key`.
+
+    `mappings` is either the cluster mappings (indexed by index name) or an
+    `IndexCatalog` built from them, which should be reused for many keys.
+    """
+    # TODO: consider matching using versioning (e.g. index-prefix-{version}-{time})
+    catalog = mappings if isinstance(mappings, IndexCatalog) else IndexCatalog(mappings)
+    return catalog.match(key)
 
 
 @six.add_metaclass(ABCMeta)
@@ -36,34 +105,128 @@ class IndexParser(object):
         pass
 
 
+# Finest time frame whose changes can alter the output of each Arrow format token
+# (keyed by the token's first letter). Fractions of a second, timestamps and UTC
+# offsets are never cached.
+TOKEN_FRAMES = {
+    'Y': 'year',
+    'M': 'month',
+    'D': 'day',
+    'd': 'day',
+    'W': 'day',
+    'H': 'hour',
+    'h': 'hour',
+    'a': 'hour',
+    'A': 'hour',
+    'm': 'minute',
+    's': 'second',
+}
+FRAMES = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+# cached index names per parser, cleared when full
+MAX_CACHED_BUCKETS = 1024
+
+
+def get_time_frame(format):
+    """
+    Get the time frame (`year`, `month`, `day`...) after which `format` may change.
+
+    Returns None if the formatted time cannot be cached by time frame.
+    """
+    frame_index = 0
+    for match in DateTimeFormatter._FORMAT_RE.finditer(format):
+        token = match.group(0)
+        if token.startswith('['):
+            continue
+        frame = TOKEN_FRAMES.get(token[0])
+        if frame is None:
+            return None
+        frame_index = max(frame_index, FRAMES.index(frame))
+    return FRAMES[frame_index]
+
+
 class TimeParser(IndexParser):
+    """
+    Resolve `{time}` in the index name from the current time or from the
+    `time_field` attribute of the exported instances.
+
+    The formatted index names only change once per time frame (e.g. once a day
+    for `YYYYMMDD`), so they are cached per frame: the frame boundaries of the
+    current time are precomputed and the index name is recomputed on rollover,
+    and the names for `time_field` values are cached by their truncated date.
+    """
 
     def __init__(self, time_field=None, format='YYYYMMDD'):
         self.format = format
         self.time_field = time_field
+        self.frame = get_time_frame(format)
+
+        self._format_time = formatters.compile_format(format)
+        self._bucket_key = None
+        if self.frame:
+            self._bucket_key = operator.attrgetter(*FRAMES[:FRAMES.index(self.frame) + 1])
+        self._buckets = {}
+        # (start, end, time string, {index: index name}) for the current time frame
+        self._current = (0, 0, None, {})
 
     def parse(self, index, mapper):
         if self.time_field:
-            time = get_attribute(mapper.instance, 'timestamp')
-        else:
-            time = arrow.now()
-        return index.format(time=self.get_time_string(time))
+            return self.get_index(index, get_attribute(mapper.instance, self.time_field))
+        return self.get_current_index(index)
+
+    def get_current_index(self, index):
+        "Get the index name for the current time"
+        if not self.frame:
+            return index.format(time=self.get_time_string(arrow.now()))
+
+        start, end, time_string, indexes = self._current
+        if not start <= time.time() < end:
+            # rollover into a new time frame
+            frame_start = arrow.now().floor(self.frame)
+            frame_end = frame_start.shift(**{self.frame + 's': 1})
+            start, end = (calendar.timegm(t.utctimetuple()) for t in (frame_start, frame_end))
+            time_string = self.get_time_string(frame_start)
+            indexes = {}
+            self._current = (start, end, time_string, indexes)
+        name = indexes.get(index)
+        if name is None:
+            name = indexes[index] = index.format(time=time_string)
+        return name
+
+    def get_index(self, index, timestamp):
+        "Get the index name for a `timestamp` (datetime, Arrow, epoch or ISO-8601 string)"
+        if not self.frame:
+            return index.format(time=self.get_time_string(timestamp))
+
+        dt = formatters.to_datetime(timestamp)
+        key = (index, self._bucket_key(dt))
+        name = self._buckets.get(key)
+        if name is None:
+            if len(self._buckets) >= MAX_CACHED_BUCKETS:
+                self._buckets.clear()
+            name = index.format(time=self._format_time.format_datetime(dt))
+            self._buckets[key] = name
+        return name
+
+    def get_indexes(self, index, timestamps):
+        "Get the list of index names for many timestamps at once"
+        get_index = self.get_index
+        return [get_index(index, timestamp) for timestamp in timestamps]
 
     def get_time_string(self, timestamp):
-        v = arrow.get(timestamp)
-        return v.format(self.format)
+        return self._format_time(timestamp)
 
 
 class YearlyParser(TimeParser):
 
     def __init__(self, time_field=None):
-        super(YearlyParser, self).__init__(format='YYYY')
+        super(YearlyParser, self).__init__(time_field=time_field, format='YYYY')
 
 
 class MonthlyParser(TimeParser):
 
     def __init__(self, time_field=None):
-        super(MonthlyParser, self).__init__(format='YYYYMM')
+        super(MonthlyParser, self).__init__(time_field=time_field, format='YYYYMM')
 
 
 class DailyParser(TimeParser):
@@ -0,0 +1,145 @@
+"""
+Sampling and rate limiting of the exported events, per mapper type.
+
+Samplers are checked before a mapper instance is mapped, so dropped events
+only cost the check. They are configured with the mapper `Meta` options or
+the `templates.register` keyword arguments:
+
+    sample_rate: ratio of the events exported (e.g. 0.1)
+    sample_key: attribute (or `instance -> value` callable) whose value decides
+        the sampling, so all the events with the same value are always either
+        exported or dropped
+    rate_limit: maximum events per second, averaged by a token bucket
+    rate_limit_burst: events that may be exported at once (defaults to `rate_limit`)
+"""
+import random
+import threading
+import time
+import zlib
+
+import six
+
+from elastic_mapper.fields import get_attribute
+
+INVALID_SAMPLE_RATE_MESSAGE = 'Sample rate `{rate}` should be a number between 0 and 1.'
+INVALID_RATE_LIMIT_MESSAGE = 'Rate limit `{rate}` should be a positive number of events per second.'
+
+SAMPLED = 'sampled'
+RATE_LIMITED = 'rate_limited'
+
+# keyword arguments of `templates.register` and `Meta` options
+OPTIONS = ('sample_rate', 'sample_key', 'rate_limit', 'rate_limit_burst')
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def key_ratio(value):
+    "Map `value` to a number in [0, 1), always the same for the same value"
+    if not isinstance(value, six.binary_type):
+        value = six.text_type(value).encode('utf-8')
+    return (zlib.crc32(value) & 0xffffffff) / 4294967296.0
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` events per second on average and up to `burst` at once.
+    """
+
+    def __init__(self, rate, burst=None):
+        assert isinstance(rate, (float, ) + six.integer_types) and rate > 0, (
+            INVALID_RATE_LIMIT_MESSAGE.format(rate=rate)
+        )
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = _clock()
+        self._lock = threading.Lock()
+
+    def consume(self):
+        "Take a token if there is one, returning whether the event is allowed"
+        with self._lock:
+            now = _clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Sampler(object):
+    """
+    Decides which events of a mapper type are exported and counts the dropped ones.
+    """
+
+    def __init__(self, sample_rate=None, sample_key=None, rate_limit=None, rate_limit_burst=None):
+        if sample_rate is not None:
+            assert (isinstance(sample_rate, (float, ) + six.integer_types) and
+                    0 <= sample_rate <= 1), INVALID_SAMPLE_RATE_MESSAGE.format(rate=sample_rate)
+        self.sample_rate = sample_rate
+        self.sample_key = sample_key
+        self.bucket = TokenBucket(rate_limit, rate_limit_burst) if rate_limit else None
+        self.dropped = {SAMPLED: 0, RATE_LIMITED: 0}
+        self._sample = self._get_sample_function()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_options(cls, options):
+        "Return a sampler from a dict of `OPTIONS`, or None if none is set"
+        options = dict((name, options.get(name)) for name in OPTIONS)
+        if options['sample_rate'] is None and not options['rate_limit']:
+            return None
+        return cls(**options)
+
+    def _get_sample_function(self):
+        rate = self.sample_rate
+        if rate is None or rate >= 1:
+            return None
+        if self.sample_key is None:
+            return lambda instance: random.random() < rate
+
+        key = self.sample_key
+        if callable(key):
+            return lambda instance: key_ratio(key(instance)) < rate
+        return lambda instance: key_ratio(get_attribute(instance, key)) < rate
+
+    def allow(self, instance):
+        "Whether the event of `instance` should be exported"
+        if self._sample is not None and not self._sample(instance):
+            self._count_dropped(SAMPLED)
+            return False
+        if self.bucket is not None and not self.bucket.consume():
+            self._count_dropped(RATE_LIMITED)
+            return False
+        return True
+
+    def _count_dropped(self, reason):
+        with self._lock:
+            self.dropped[reason] += 1
+
+    def filter(self, iterable):
+        "Generate the objects of `iterable` that should be exported"
+        allow = self.allow
+        return (instance for instance in iterable if allow(instance))
+
+    def reset(self):
+        "Reset the dropped events counters"
+        with self._lock:
+            self.dropped = {SAMPLED: 0, RATE_LIMITED: 0}
+
+
+def get_dropped_events():
+    """
+    Get the events dropped by the samplers of the registered types.
+
+    Returns a `typename -> {'sampled': count, 'rate_limited': count}` dict.
+    """
+    # imported here since `templates.register` creates samplers
+    from elastic_mapper import templates
+
+    dropped = {}
+    for typename, mapper_cls in six.iteritems(templates.registry):
+        sampler = mapper_cls._meta.sampler
+        if sampler is not None:
+            dropped[typename] = dict(sampler.dropped)
+    return dropped
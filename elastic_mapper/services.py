@@ -1,6 +1,6 @@
 import six
 
-from elastic_mapper import templates
+from elastic_mapper import config, templates
 
 MISSING_TYPENAME_MESSAGE = (
     'There is no registered typename `{typename}`.\n'
@@ -14,30 +14,94 @@ INVALID_SERVICE_METHOD_MESSAGE = (
 )
 
 EXPORT_PREFIX = 'export_'
+ASYNC_EXPORT_PREFIX = 'aexport_'
+EXPORT_MANY_PREFIX = 'export_many_'
+EXPORT_STREAM_PREFIX = 'export_stream_'
+# longest first, since `export_many_<typename>` also starts with `export_`
+PREFIXES = (EXPORT_MANY_PREFIX, EXPORT_STREAM_PREFIX, ASYNC_EXPORT_PREFIX, EXPORT_PREFIX)
+
+
+def _export(mapper_cls):
+    sampler = mapper_cls._meta.sampler
+    if sampler is not None:
+        # check the sampler before creating the mapper, so dropped events are cheap
+        def sampled_wrapper(instance=None, *args, **kwargs):
+            if sampler.allow(instance):
+                mapper = mapper_cls(instance, *args, **kwargs)
+                config.Config().dispatcher.dispatch(mapper)
+        return sampled_wrapper
+
+    def wrapper(*args, **kwargs):
+        mapper = mapper_cls(*args, **kwargs)
+        mapper.export()
+    return wrapper
+
+
+def _async_export(mapper_cls):
+    # asyncio support is only available (and imported) on python 3
+    from elastic_mapper import async_exporters
+
+    def async_wrapper(*args, **kwargs):
+        mapper = mapper_cls(*args, **kwargs)
+        return async_exporters.export_async(mapper)
+    return async_wrapper
+
+
+ENTRY_POINTS = {
+    EXPORT_PREFIX: _export,
+    ASYNC_EXPORT_PREFIX: _async_export,
+    EXPORT_MANY_PREFIX: lambda mapper_cls: mapper_cls.export_many,
+    EXPORT_STREAM_PREFIX: lambda mapper_cls: mapper_cls.export_stream,
+}
 
 
 class ServiceMetaclass(type):
+    """
+    Resolves the `<prefix><typename>` export entry points of the services.
 
-    def __getattr__(cls, key):
-        if key.startswith(EXPORT_PREFIX):
-            typename = key.replace(EXPORT_PREFIX, '')
-            mapper_cls = templates.Template.types.get(typename, None)
-            if not mapper_cls:
-                typename_list = ','.join(templates.Template.types.keys())
-                msg = MISSING_TYPENAME_MESSAGE.format(typename=typename,
-                                                      typename_list=typename_list)
-                raise AttributeError(msg)
-
-            def wrapper(*args, **kwargs):
-                mapper = mapper_cls(*args, **kwargs)
-                mapper.export()
-            return wrapper
-        elif not hasattr(cls, key):
-            typename_list = ','.join(templates.Template.types.keys())
-            msg = INVALID_SERVICE_METHOD_MESSAGE.format(method=key,
-                                                        prefix=EXPORT_PREFIX,
-                                                        typename_list=typename_list)
+    Entry points are resolved on first use and cached on the class, so later
+    calls do not go through the metaclass. Registering a type clears the
+    cached entry points of its typename.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(ServiceMetaclass, cls).__init__(name, bases, attrs)
+        templates.registry_listeners.append(cls._clear_entry_points)
+
+    def _clear_entry_points(cls, typename):
+        for prefix in PREFIXES:
+            if prefix + typename in cls.__dict__:
+                delattr(cls, prefix + typename)
+
+    def _get_mapper_cls(cls, typename):
+        mapper_cls = templates.registry.get(typename, None)
+        if not mapper_cls:
+            typename_list = ','.join(templates.registry.keys())
+            msg = MISSING_TYPENAME_MESSAGE.format(typename=typename,
+                                                  typename_list=typename_list)
             raise AttributeError(msg)
+        return mapper_cls
+
+    def _resolve(cls, key):
+        prefixes = [prefix for prefix in PREFIXES if key.startswith(prefix)]
+        for prefix in prefixes:
+            # `export_many_x` may also be the single export of a `many_x` type
+            if key[len(prefix):] in templates.registry:
+                return prefix, templates.registry[key[len(prefix):]]
+        if prefixes:
+            return prefixes[0], cls._get_mapper_cls(key[len(prefixes[0]):])
+        # __getattr__ is only called for attributes missing from the class
+        typename_list = ','.join(templates.registry.keys())
+        msg = INVALID_SERVICE_METHOD_MESSAGE.format(method=key,
+                                                    prefix=EXPORT_PREFIX,
+                                                    typename_list=typename_list)
+        raise AttributeError(msg)
+
+    def __getattr__(cls, key):
+        prefix, mapper_cls = cls._resolve(key)
+        entry_point = ENTRY_POINTS[prefix](mapper_cls)
+        setattr(cls, key, staticmethod(entry_point))
+        return entry_point
 
 
 @six.add_metaclass(ServiceMetaclass)
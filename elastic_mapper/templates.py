@@ -2,16 +2,39 @@ import collections
 import inspect
 import warnings
 
-from elastic_mapper import repr_utils
+import six
+
+from elastic_mapper import frozen_mappings, repr_utils, samplers
 
 INVALID_TYPENAME_MSG = (
     'Type name `{typename}` for `{template}` contains invalid characters. '
     'Automatically converting typename `{typename}` into `{sanitized}`.'
 )
+INVALID_SAMPLING_OPTION_MSG = 'Unknown sampling options: {options}.'
+
+
+# typename -> mapper class of all the registered types
+registry = {}
+# callables notified with the typename of every registered type
+registry_listeners = []
+
+
+class TemplateMetaclass(type):
+
+    def __init__(cls, name, bases, attrs):
+        super(TemplateMetaclass, cls).__init__(name, bases, attrs)
+        # typename -> mapper class of the types registered into this template
+        if 'types' not in attrs:
+            cls.types = {}
 
+    def __setattr__(cls, name, value):
+        super(TemplateMetaclass, cls).__setattr__(name, value)
+        if name == 'types':
+            cls.clear_generated_template()
 
+
+@six.add_metaclass(TemplateMetaclass)
 class Template(object):
-    # types = dict()
 
     @classmethod
     def _get_meta_settings(self):
@@ -23,7 +46,7 @@ class Template(object):
         return attrs
 
     @classmethod
-    def generate_template(cls):
+    def _generate_template(cls):
         data = collections.OrderedDict()
         data['template'] = cls.parse_index_template()
         settings = cls._get_meta_settings()
@@ -41,6 +64,33 @@ class Template(object):
 
         return data
 
+    @classmethod
+    def _get_generated_template(cls):
+        return frozen_mappings.get_generated(cls, '_generated_template', cls._generate_template)
+
+    @classmethod
+    def generate_template(cls):
+        """
+        Elasticsearch index template with the mappings of all the template types.
+
+        Generated once per class and returned frozen; `register` clears it.
+        """
+        return cls._get_generated_template().data
+
+    @classmethod
+    def get_template_json(cls):
+        "Canonical JSON of `generate_template`"
+        return cls._get_generated_template().json
+
+    @classmethod
+    def get_template_hash(cls):
+        "Stable hash of `generate_template`"
+        return cls._get_generated_template().hash
+
+    @classmethod
+    def clear_generated_template(cls):
+        frozen_mappings.clear_generated(cls, '_generated_template')
+
     @classmethod
     def parse_index(cls, mapper):
         if mapper:
@@ -59,7 +109,15 @@ class Template(object):
         return cls.index.format(time='*')
 
 
-def register(typename, template_cls):
+def register(typename, template_cls, **sampling):
+    """
+    Register the decorated mapper class as the `typename` type of `template_cls`.
+
+    `sampling` sets the sampling and rate limiting options of the type (see
+    `samplers`), overriding the ones in the mapper `Meta`.
+    """
+    invalid = set(sampling) - set(samplers.OPTIONS)
+    assert not invalid, INVALID_SAMPLING_OPTION_MSG.format(options=', '.join(sorted(invalid)))
 
     def wrapped(mapper_cls):
         # sanitize typename to make sure it's a valid python identifier
@@ -70,12 +128,21 @@ def register(typename, template_cls):
                                               sanitized=sanitized)
             warnings.warn(msg, SyntaxWarning)
         # add the mapper to the template types dict using the sanitized name as the key
-        types = getattr(template_cls, 'types', dict())
-        types[sanitized] = mapper_cls
-        setattr(template_cls, 'types', types)
+        template_cls.types[sanitized] = mapper_cls
+        registry[sanitized] = mapper_cls
+        for listener in registry_listeners:
+            listener(sanitized)
         # add the sanitized typename and template properties to the mapper
         mapper_cls.typename = sanitized
         mapper_cls.template = template_cls
+        if sampling:
+            options = dict(mapper_cls._meta.sampling)
+            options.update(sampling)
+            mapper_cls._meta.sampling = options
+            mapper_cls._meta.sampler = samplers.Sampler.from_options(options)
+        # the generated mappings depend on the typename and the types
+        mapper_cls.clear_generated_mapping()
+        template_cls.clear_generated_template()
         return mapper_cls
 
     return wrapped
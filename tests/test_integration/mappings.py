@@ -14,6 +14,9 @@ class TestIntMapper(mappers.Mapper):
     int_field = mappers.IntegerField(precision_step=16,
                                      boost=0.5)
 
+    class Meta:
+        dynamic_fields = '__all__'
+
 
 @elastic_templates.register('test_type_date', TestDateTemplate)
 class TestDateMapper(mappers.Mapper):
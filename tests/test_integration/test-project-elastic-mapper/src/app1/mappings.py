@@ -1,7 +1,7 @@
 from elastic_mapper import mappers
 from elastic_mapper import templates as elastic_templates
 
-from templates import TestTemplateApp1
+from app1.templates import TestTemplateApp1
 
 
 class NestedMapper(mappers.Mapper):
@@ -2,7 +2,7 @@ from elastic_mapper import mappers
 from elastic_mapper import templates as elastic_templates
 
 from app1.mappings import NestedMapper
-from templates import TestTemplateApp2
+from app2.templates import TestTemplateApp2
 
 
 @elastic_templates.register('test_type_app2', TestTemplateApp2)
@@ -1,13 +1,14 @@
 import pytest
 import elasticsearch
 import datetime
+import json
 
 import six
 
 from elastic_mapper import mappers
 from elastic_mapper import parsers
 from elastic_mapper import templates as elastic_templates
-from elastic_mapper.cli import differs
+from elastic_mapper.cli import differs, snapshots
 from elastic_mapper.cli.differs import State
 
 from mappings import TestIntMapper, TestStringMapper, TestDateMapper
@@ -215,6 +216,42 @@ class TestMappingDiff(BaseESTest):
         assert conflict.source_param == 'not_analyzed'
         assert conflict.dest_param == 'analyzed'
 
+    def test_nested_conflicts(self):
+        source = {
+            'object_field': {
+                'properties': {
+                    'string_field': {'type': 'string', 'index': 'not_analyzed'},
+                    'int_field': {'type': 'integer'},
+                },
+            },
+        }
+        dest = {
+            'object_field': {
+                'properties': {
+                    'string_field': {'type': 'string', 'index': 'no'},
+                    'int_field': {'type': 'long', 'index': 'no'},
+                    'dynamic_field': {'type': 'string'},
+                },
+            },
+        }
+        states = differs.MappingDiffer('test_type_object', source, dest).diff()
+        assert states['object_field.string_field'][0].state == State.param_conflict
+        assert states['object_field.string_field'][0].source_param == 'no'
+        # type conflicts hide the other issues of the field
+        assert len(states['object_field.int_field']) == 1
+        assert states['object_field.int_field'][0].state == State.type_conflict
+        assert states['object_field.dynamic_field'][0].state == State.extra_field
+
+    def test_normalized_mapping_is_shared(self):
+        mapping = differs.normalize_mapping({'string_field': {'type': 'string'}})
+        assert differs.normalize_mapping(mapping) is mapping
+        with pytest.raises(TypeError):
+            mapping['string_field'] = {'type': 'long'}
+
+        differ = differs.MappingDiffer('test_type_string', mapping, mapping)
+        assert differ.source is mapping
+        assert differ.dest is mapping
+
 
 class TestTimelyMappingDiff(BaseESTest):
     NUM_TEST_INDICES = 3  # larger numbers make the tests slower
@@ -292,6 +329,63 @@ class TestTimelyMappingDiff(BaseESTest):
         assert 'long' in states['integer_field'][0].defined_types
         assert 'string' in states['integer_field'][0].defined_types
 
+    def test_diff_from_snapshot(self, tmpdir):
+        _create_template(TestDateTemplate)
+        mapper = TestDateMapper({
+            "timestamp": datetime.datetime(2000, 1, 1, 0, 0, 0),
+            "integer_field": 666,
+        })
+        mapper.export()
+
+        path = str(tmpdir.join('snapshot.json.gz'))
+        snapshots.ClusterSnapshot.download(es_host, path)
+        cluster = snapshots.ClusterSnapshot.load(path, index_patterns=[TestDateTemplate.index])
+        assert list(cluster.mappings.keys()) == ['test-date-20000101']
+        assert cluster.get_template(TestDateTemplate.name) is not None
+        assert cluster.catalog.match(TestDateTemplate.index) == ['test-date-20000101']
+
+        differ = differs.TimelyIndexDiffer(TestDateTemplate.name,
+                                           TestDateMapper.generate_mapping(),
+                                           TestDateTemplate.index,
+                                           cluster.mappings,
+                                           catalog=cluster.catalog)
+        for fieldname, states in six.iteritems(differ.diff()):
+            assert all([state.state == State.ok for state in states])
+
+    def test_stream_mappings(self):
+        mappings = es_host.indices.get_mapping(index='*')
+        items = snapshots.JSONObjectStream(json.dumps(mappings)[i:i + 10]
+                                           for i in range(0, len(json.dumps(mappings)), 10))
+        assert dict(items.items()) == mappings
+
+    def test_index_type_conflict_many_indices(self):
+        field_types = ['long'] * 100 + ['string'] + ['double'] * 100
+        all_mappings = {}
+        for i, field_type in enumerate(field_types):
+            all_mappings['test-date-%04d' % i] = {
+                'mappings': {
+                    'test_type_date': {
+                        'properties': {
+                            'integer_field': {'type': field_type},
+                            'object_field': {
+                                'properties': {
+                                    'nested_field': {'type': 'string'},
+                                },
+                            },
+                        },
+                    },
+                },
+            }
+
+        differ = differs.TimelyIndexDiffer(TestDateTemplate.name,
+                                           TestDateMapper.generate_mapping(),
+                                           TestDateTemplate.index,
+                                           all_mappings)
+        conflicts = differ._compute_index_conflicts()
+        assert list(conflicts.keys()) == ['integer_field']
+        assert conflicts['integer_field'][0].defined_types == {'long', 'string', 'double'}
+        assert conflicts['integer_field'][0].description.endswith('[double,long,string]')
+
 
 class TestTemplateDiff(BaseESTest):
 
@@ -362,3 +456,89 @@ class TestTemplateDiff(BaseESTest):
         with pytest.raises(elasticsearch.exceptions.RequestError) as excinfo:
             _create_template(TestStringTemplate)
         assert 'string_field' in str(excinfo.value)
+
+    def test_template_inconsistent_nested_types(self):
+        def type_mapping(nested_type):
+            return {
+                'properties': {
+                    'string_field': {'type': 'string'},
+                    'object_field': {
+                        'properties': {
+                            'nested_field': {'type': nested_type},
+                        },
+                    },
+                },
+            }
+
+        source = {
+            'test_type_1': type_mapping('string'),
+            'test_type_2': type_mapping('string'),
+            'test_type_3': type_mapping('long'),
+        }
+        result = differs.TemplateDiffer(TestStringTemplate.name, source, source).diff()
+        for typename in source:
+            states = result.type_states[typename]
+            assert states['string_field'][0].state == State.ok
+            assert states['object_field.nested_field'][0].state == State.inconsistent_field
+
+
+class TestManifest(object):
+
+    @pytest.fixture
+    def project(self, tmpdir):
+        tmpdir.join('__init__.py').write('')
+        tmpdir.join('manifest_templates.py').write(
+            'from elastic_mapper import mappers, templates\n'
+            'class ManifestTemplate(templates.Template):\n'
+            '    name = "manifest_template"\n'
+            '    index = "manifest-{time}"\n'
+            '@templates.register("manifest_type", ManifestTemplate)\n'
+            'class ManifestMapper(mappers.Mapper):\n'
+            '    string_field = mappers.StringField()\n')
+        return tmpdir
+
+    def test_manifest(self, project):
+        from elastic_mapper.cli import loaders
+
+        path = str(project)
+        project_loader = loaders.ProjectMappingLoader(path)
+        project.join(loaders.MANIFEST_NAME).write(json.dumps(project_loader.compile()))
+
+        loader = loaders.ManifestMappingLoader.load(path)
+        assert json.loads(json.dumps(loader.get_templates())) == json.loads(
+            json.dumps(project_loader.get_templates()))
+        assert loader.get_mappings() == project_loader.get_mappings()
+        mapper = loader.mappings['manifest_type']
+        assert mapper.template is loader.templates['manifest_template']
+        assert mapper.template.parse_index_template() == 'manifest-*'
+
+        # outdated manifests are ignored
+        project.join('manifest_other.py').write('')
+        assert loaders.ManifestMappingLoader.load(path) is None
+
+
+class TestTemplateHash(object):
+
+    def test_hash_template(self):
+        class TestHashTemplate(elastic_templates.Template):
+            name = "test_template_hash"
+            index = "test-hash-{time}"
+
+            class Meta:
+                number_of_shards = 1
+                refresh_interval = '5s'
+
+        @elastic_templates.register('test_type_hash', TestHashTemplate)
+        class TestHashMapper(mappers.Mapper):
+            string_field = mappers.StringField()
+
+        template = TestHashTemplate.generate_template()
+        # as returned by Elasticsearch
+        es_template = json.loads(json.dumps(template))
+        es_template['order'] = 0
+        es_template['aliases'] = {}
+        es_template['settings'] = {'index': {'number_of_shards': '1', 'refresh_interval': '5s'}}
+        assert differs.hash_template(template) == differs.hash_template(es_template)
+
+        es_template['settings']['index']['number_of_shards'] = '2'
+        assert differs.hash_template(template) != differs.hash_template(es_template)
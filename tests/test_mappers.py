@@ -1,9 +1,19 @@
+import calendar
+import datetime
 import json
+import os
+import threading
+import time
 
+import arrow
 import pytest
+from dateutil import tz as dateutil_tz
 from six import string_types
+from six.moves import BaseHTTPServer, http_client, socketserver
 
-from elastic_mapper import config, exporters, mappers, templates
+from elastic_mapper import (config, dispatchers, exporters, formatters, frozen_mappings, mappers,
+                            parsers, samplers, templates)
+from elastic_mapper.cli import importutils, snapshots
 from elastic_mapper.services import TrackingService
 
 
@@ -50,6 +60,44 @@ class TestMapper(object):
         tm = TestMapper()
         assert tm.mapped_data == {'method_field': RESULT}
 
+    def test_method_field_get_attribute_override(self):
+        class UpperStringField(mappers.StringField):
+            def get_attribute(self, instance):
+                return super(UpperStringField, self).get_attribute(instance).upper()
+
+        class TestMapper(mappers.Mapper):
+            method_field = UpperStringField(method='get_test_method_field')
+
+            def get_test_method_field(self, obj):
+                return obj['test_attr']
+
+        tm = TestMapper({'test_attr': 'test method string'})
+        assert tm.mapped_data == {'method_field': 'TEST METHOD STRING'}
+
+    def test_custom_field_mapper_instance(self):
+        class PathField(mappers.StringField):
+            def to_representation(self, value):
+                return '%s/%s' % (value, self.mapper.instance['b'])
+
+        class TestMapper(mappers.Mapper):
+            a = PathField()
+
+        assert TestMapper({'a': 'x', 'b': 'y'}).mapped_data == {'a': 'x/y'}
+        assert list(TestMapper.map_many([{'a': 'x', 'b': 'z'}])) == [{'a': 'x/z'}]
+
+        TestMapper._meta.compiled = True
+        assert TestMapper({'a': 'x', 'b': 'y'}).mapped_data == {'a': 'x/y'}
+
+    def test_bound_method_field_get_attribute(self):
+        class TestMapper(mappers.Mapper):
+            d = mappers.StringField(method='get_d')
+
+            def get_d(self, obj):
+                return obj['test_attr']
+
+        tm = TestMapper()
+        assert tm.fields[0].get_attribute({'test_attr': 'value'}) == 'value'
+
     def test_nested_mapper(self):
         class NestedMapper(mappers.Mapper):
             test_attr = mappers.StringField()
@@ -65,11 +113,66 @@ class TestMapper(object):
         tm = TestMapper(test_args)
         assert tm.mapped_data == test_args
 
+    def test_nested_mapper_method_field(self):
+        class NestedMapper(mappers.Mapper):
+            method_field = mappers.StringField(method='get_method_field')
+
+            def get_method_field(self, obj):
+                return obj['test_attr'].upper()
+
+        class TestMapper(mappers.Mapper):
+            nested_attr = NestedMapper()
+
+        tm = TestMapper({'nested_attr': {'test_attr': 'nested test value'}})
+        assert tm.mapped_data == {'nested_attr': {'method_field': 'NESTED TEST VALUE'}}
+
+    def test_fields_shared_across_instances(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        tm_1 = TestMapper({'test_attr': 'value 1'})
+        tm_2 = TestMapper({'test_attr': 'value 2'})
+        assert tm_1._plan is tm_2._plan
+        assert tm_1.fields[0].mapper is tm_1
+        assert tm_1.mapped_data == {'test_attr': 'value 1'}
+        assert tm_2.mapped_data == {'test_attr': 'value 2'}
+
+    def test_inherited_fields_bound_per_class(self):
+        class BaseMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        class TestMapper(BaseMapper):
+            another_attr = mappers.IntegerField(source='another_source')
+
+        assert [f.field_name for f in BaseMapper().fields] == ['test_attr']
+        data = TestMapper({'test_attr': 'value', 'another_source': '3'}).mapped_data
+        assert data == {'test_attr': 'value', 'another_attr': 3}
+
+    def test_map_many(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField()
+
+        objects = [{'test_attr': str(i)} for i in range(5)]
+        documents = TestMapper.map_many(objects)
+        assert list(documents) == [TestMapper(obj).mapped_data for obj in objects]
+
+    def test_map_many_chunks(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField()
+
+        objects = [{'test_attr': i} for i in range(5)]
+        chunks = list(TestMapper.map_many(objects, chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert chunks[-1] == [{'test_attr': 4}]
+
     def test_dynamic_attribute(self):
         class TestMapper(mappers.Mapper):
             test_attr = mappers.StringField()
             # no such field `dynamic_attr`
 
+            class Meta:
+                dynamic_fields = '__all__'
+
         test_args = {
             'test_attr': 'test value',
             'dynamic_attr': 3,
@@ -79,6 +182,137 @@ class TestMapper(object):
         assert tm.mapped_data == test_args
 
 
+class TestDynamicFields(object):
+
+    def test_dynamic_fields_names(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+            class Meta:
+                dynamic_fields = ('allowed_attr', )
+
+        test_args = {
+            'test_attr': 'test value',
+            'allowed_attr': 1,
+            'another_attr': 2,
+        }
+        assert TestMapper(test_args).mapped_data == {'test_attr': 'test value',
+                                                     'allowed_attr': 1}
+
+    def test_dynamic_fields_prefixes(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+            class Meta:
+                dynamic_fields = ('extra_*', )
+                exclude_dynamic_fields = ('extra_private_*', 'extra_secret')
+
+        test_args = {
+            'test_attr': 'test value',
+            'extra_count': 1,
+            'extra_secret': 2,
+            'extra_private_token': 3,
+            'another_attr': 4,
+        }
+        assert TestMapper(test_args).mapped_data == {'test_attr': 'test value',
+                                                     'extra_count': 1}
+
+    def test_dynamic_fields_disabled(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+            class Meta:
+                dynamic_fields = ()
+
+        test_args = {
+            'test_attr': 'test value',
+            'dynamic_attr': 3,
+        }
+        assert TestMapper(test_args).mapped_data == {'test_attr': 'test value'}
+
+    def test_dynamic_fields_skip_sources(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField(source='source_attr')
+
+            class Meta:
+                dynamic_fields = '__all__'
+
+        test_args = {
+            'source_attr': '3',
+            'test_attr': 'raw value',
+            'dynamic_attr': 'dynamic value',
+        }
+        assert TestMapper(test_args).mapped_data == {'test_attr': 3,
+                                                     'dynamic_attr': 'dynamic value'}
+
+
+class TestCompiledMapper(object):
+
+    @pytest.fixture
+    def mapper_cls(self):
+        class UpperStringField(mappers.StringField):
+            def to_representation(self, value):
+                return value.upper()
+
+        class NestedMapper(mappers.Mapper):
+            nested_attr = mappers.IntegerField(source='nested_source')
+
+        class TestMapper(mappers.Mapper):
+            string_attr = mappers.StringField()
+            float_attr = mappers.FloatField()
+            custom_attr = UpperStringField(source='string_attr')
+            method_attr = mappers.BooleanField(method='get_method_attr')
+            nested = NestedMapper()
+
+            class Meta:
+                compiled = True
+
+            def get_method_attr(self, obj):
+                return float(obj['float_attr']) > 1
+
+        return TestMapper
+
+    def test_compiled_meta_option(self, mapper_cls):
+        test_args = {
+            'string_attr': 'test value',
+            'float_attr': '1.5',
+            'nested': {'nested_source': 3.0},
+        }
+        assert mapper_cls.is_compiled()
+        assert mapper_cls(test_args).mapped_data == {
+            'string_attr': 'test value',
+            'float_attr': 1.5,
+            'custom_attr': 'TEST VALUE',
+            'method_attr': True,
+            'nested': {'nested_attr': 3},
+        }
+        assert 'int(' in mapper_cls.get_compiled_function().source
+
+    def test_compiled_none_values(self, mapper_cls):
+        test_args = {
+            'string_attr': None,
+            'float_attr': 0,
+            'nested': None,
+        }
+        data = list(mapper_cls.map_many([test_args]))[0]
+        assert data['string_attr'] is None
+        assert data['nested'] is None
+        assert data['method_attr'] is False
+
+    def test_compiled_global_switch(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        conf = config.Config()
+        assert not TestMapper.is_compiled()
+        conf.compiled_mappers = True
+        try:
+            assert TestMapper.is_compiled()
+            assert TestMapper({'test_attr': 1}).mapped_data == {'test_attr': '1'}
+        finally:
+            conf.compiled_mappers = False
+
+
 class TestField(object):
 
     def test_valid_field_options(self):
@@ -156,6 +390,47 @@ class TestIntegerField(object):
         assert test_attr_2.mapping_data == {'type': 'integer', 'precision_step': 16}
 
 
+class TestDateField(object):
+
+    @pytest.mark.parametrize('strftime', [
+        'YYYY-MM-DDTHH:mm:ss.SSSZ',
+        'YY M D DDD DDDD d H h hh m s S SS SSSS SSSSS SSSSSS ZZ',
+        'MMMM MMM Do dddd ddd a A W X x ZZZ',
+        '[at] YYYY-MM-DD 100%',
+    ])
+    @pytest.mark.parametrize('value', [
+        datetime.datetime(2016, 3, 4, 0, 5, 6, 789123),
+        arrow.get(1457049906).to('Europe/Madrid').datetime,
+        1457049906,
+        1457049906.5,
+        1457049906123,
+        arrow.get(1457049906).to('US/Pacific'),
+        '2016-03-04T01:02:03+02:00',
+        datetime.datetime(2016, 3, 4, 1, 2, 3, tzinfo=dateutil_tz.tzoffset(None, 3600)),
+    ])
+    def test_matches_arrow_format(self, strftime, value):
+        field = mappers.DateField(strftime=strftime)
+        assert field.to_representation(value) == arrow.get(value).format(strftime)
+
+    @pytest.mark.parametrize('token', [
+        'YYYY', 'YY', 'MMMM', 'MMM', 'MM', 'M', 'DDDD', 'DDD', 'DD', 'D', 'Do', 'dddd', 'ddd',
+        'd', 'HH', 'H', 'hh', 'h', 'mm', 'm', 'ss', 's', 'SSSSSS', 'SSSSS', 'SSSS', 'SSS', 'SS',
+        'S', 'ZZZ', 'ZZ', 'Z', 'a', 'A', 'X', 'x', 'W', '[YYYY]',
+    ])
+    def test_token_matches_arrow_format(self, token):
+        formatter = formatters.compile_format(token)
+        for hour in range(24):
+            value = datetime.datetime(2016, 1, 3, hour, 5, 6, 7891, tzinfo=dateutil_tz.tzutc())
+            assert formatter(value) == arrow.get(value).format(token)
+
+    def test_date_field_data(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.DateField(strftime='YYYY-MM-DD')
+
+        data = TestMapper({'test_attr': datetime.datetime(2016, 3, 4)}).mapped_data
+        assert data == {'test_attr': '2016-03-04'}
+
+
 class TestTemplate(object):
 
     def setup_method(self, method):
@@ -192,6 +467,308 @@ class TestTemplate(object):
         assert 'settings' in data
         assert data['settings']['number_of_shards'] == 1
 
+    def test_generated_template_cache(self):
+        class TestTemplate(templates.Template):
+            name = "test_template"
+            index = "test-*"
+
+        @templates.register('test_type', TestTemplate)
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        data = TestTemplate.generate_template()
+        template_hash = TestTemplate.get_template_hash()
+        assert TestTemplate.generate_template() is data
+        assert TestMapper.generate_mapping()['test_type'] == data['mappings']['test_type']
+        assert json.loads(TestTemplate.get_template_json()) == json.loads(json.dumps(data))
+        with pytest.raises(TypeError):
+            data['mappings']['test_type']['properties']['test_attr']['type'] = 'long'
+
+        # registering a type regenerates the template
+        @templates.register('other_type', TestTemplate)
+        class OtherMapper(mappers.Mapper):
+            other_attr = mappers.IntegerField()
+
+        assert list(TestTemplate.generate_template()['mappings']) == ['test_type', 'other_type']
+        assert TestTemplate.get_template_hash() != template_hash
+
+    def test_generated_mapping_order_and_copy(self):
+        class TestTemplate(templates.Template):
+            name = "test_template"
+            index = "test-*"
+
+        @templates.register('test_type', TestTemplate)
+        class TestMapper(mappers.Mapper):
+            z_attr = mappers.StringField()
+            a_attr = mappers.IntegerField()
+            m_attr = mappers.DateField()
+
+        mapping = TestMapper.generate_mapping()
+        properties = mapping['test_type']['properties']
+        assert list(properties) == ['z_attr', 'a_attr', 'm_attr']
+        assert properties == {'z_attr': {'type': 'string'}, 'a_attr': {'type': 'integer'},
+                              'm_attr': {'type': 'date'}}
+
+        properties = properties.copy()
+        properties['other_attr'] = {'type': 'long'}
+        assert list(properties) == ['z_attr', 'a_attr', 'm_attr', 'other_attr']
+
+        thawed = frozen_mappings.thaw(mapping)
+        thawed['test_type']['properties']['z_attr']['type'] = 'keyword'
+        assert list(thawed['test_type']['properties']) == ['z_attr', 'a_attr', 'm_attr']
+        assert mapping['test_type']['properties']['z_attr'] == {'type': 'string'}
+
+    def test_template_own_types(self):
+        class TestTemplate(templates.Template):
+            name = "test_template"
+            index = "test-*"
+
+        class OtherTemplate(templates.Template):
+            name = "other_template"
+            index = "other-*"
+
+        @templates.register('test_type', TestTemplate)
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        assert list(TestTemplate.types) == ['test_type']
+        assert OtherTemplate.types == {}
+        assert 'mappings' not in OtherTemplate.generate_template()
+        assert templates.registry['test_type'] is TestMapper
+
+    def test_mapping_hash(self):
+        class TestMapper(mappers.Mapper):
+            typename = 'test_type'
+            test_attr = mappers.StringField()
+            int_attr = mappers.IntegerField()
+
+        class SameMapper(mappers.Mapper):
+            typename = 'test_type'
+            int_attr = mappers.IntegerField()
+            test_attr = mappers.StringField()
+
+        assert TestMapper.get_mapping_json() == SameMapper.get_mapping_json()
+        assert TestMapper.get_mapping_hash() == SameMapper.get_mapping_hash()
+
+
+class TestTimeParser(object):
+
+    def test_time_field(self):
+        parser = parsers.MonthlyParser(time_field='created')
+
+        class TestMapper(mappers.Mapper):
+            created = mappers.DateField()
+
+        mapper = TestMapper({'created': datetime.datetime(2016, 3, 4, 5, 6)})
+        assert parser.parse('test-{time}', mapper) == 'test-201603'
+
+    def test_get_indexes(self):
+        parser = parsers.DailyParser()
+        timestamps = [
+            1457049906,
+            datetime.datetime(2016, 1, 1, 23, 59),
+            arrow.get('2016-01-01T23:30:00+00:00').to('Asia/Tokyo'),
+            '2016-01-01T01:00:00-05:00',
+            datetime.datetime(2016, 1, 1, 0, 1),
+        ]
+        assert parser.get_indexes('test-{time}', timestamps) == [
+            'test-' + arrow.get(timestamp).format('YYYYMMDD') for timestamp in timestamps
+        ]
+
+    def test_time_frame(self):
+        assert parsers.get_time_frame('YYYY') == 'year'
+        assert parsers.get_time_frame('YYYY.MM.DD') == 'day'
+        assert parsers.get_time_frame('[day-]DDDD-HH') == 'hour'
+        assert parsers.get_time_frame('YYYYMMDD-ssZ') is None
+
+    def test_rollover(self, monkeypatch):
+        now = arrow.get(2016, 3, 4, 23, 59, 59)
+        monkeypatch.setattr(parsers.arrow, 'now', lambda: now)
+        monkeypatch.setattr(parsers.time, 'time', lambda: calendar.timegm(now.utctimetuple()))
+
+        parser = parsers.DailyParser()
+        assert parser.get_current_index('test-{time}') == 'test-20160304'
+        now = now.shift(seconds=1)
+        assert parser.get_current_index('test-{time}') == 'test-20160305'
+        assert parser.get_current_index('other-{time}') == 'other-20160305'
+
+
+class TestIndexCatalog(object):
+
+    @pytest.fixture
+    def catalog(self):
+        return parsers.IndexCatalog([
+            'test-date-20160102',
+            'test-date-20160101',
+            'test-date-20160201',
+            'test-date-v2-20160101',
+            'test-date-',
+            'test-dates-20160101',
+            'test-datex20160101',
+            'other-20160101',
+        ])
+
+    def test_match(self, catalog):
+        assert catalog.match('test-date-{time}') == [
+            'test-date-20160101',
+            'test-date-20160102',
+            'test-date-20160201',
+            'test-date-v2-20160101',
+        ]
+        assert catalog.match('test-date-v2-{time}') == ['test-date-v2-20160101']
+        assert catalog.match('missing-{time}') == []
+
+    def test_match_range(self, catalog):
+        assert catalog.match('test-date-{time}', start='20160102', end='201601') == [
+            'test-date-20160102',
+        ]
+        assert catalog.match('test-date-{time}', start='201602', end='2016') == [
+            'test-date-20160201',
+        ]
+
+    def test_get_matching_indexes(self, catalog):
+        mappings = dict((name, {}) for name in catalog.names)
+        assert (parsers.get_matching_indexes('test-date-{time}', mappings) ==
+                catalog.match('test-date-{time}'))
+        assert 'other-20160101' in catalog
+        assert 'other-' not in catalog
+
+
+class TestProjectDiscovery(object):
+
+    @pytest.fixture(autouse=True)
+    def cache_dir(self, tmpdir_factory, monkeypatch):
+        cache_dir = tmpdir_factory.mktemp('cache')
+        monkeypatch.setenv(importutils.DISCOVERY_CACHE_ENV, str(cache_dir))
+        return cache_dir
+
+    @pytest.fixture
+    def project(self, tmpdir):
+        tmpdir.join('__init__.py').write('')
+        tmpdir.join('discovery_templates.py').write(
+            'from elastic_mapper.templates import Template as BaseTemplate\n'
+            'class FirstTemplate(BaseTemplate):\n'
+            '    name = "first"\n')
+        tmpdir.join('discovery_subclasses.py').write(
+            'from discovery_templates import FirstTemplate\n'
+            'class SecondTemplate(FirstTemplate):\n'
+            '    name = "second"\n')
+        tmpdir.join('discovery_mappers.py').write(
+            'from elastic_mapper import mappers, templates\n'
+            'import discovery_templates\n'
+            '@templates.register("first_type", discovery_templates.FirstTemplate)\n'
+            'class FirstMapper(mappers.Mapper):\n'
+            '    pass\n')
+        tmpdir.join('discovery_other.py').write(
+            'raise ImportError("should not be imported")\n'
+            'class Other(object):\n'
+            '    pass\n')
+        return tmpdir
+
+    def test_find_candidates(self, project):
+        scans = importutils.scan_files(str(project), [
+            'discovery_templates.py', 'discovery_subclasses.py',
+            'discovery_mappers.py', 'discovery_other.py'])
+        assert importutils.find_candidates(scans, ['Template']) == [
+            'discovery_mappers.py', 'discovery_subclasses.py', 'discovery_templates.py']
+        assert importutils.find_candidates(scans, ['Mapper']) == ['discovery_mappers.py']
+        assert importutils.find_candidates(scans, ['Missing']) == []
+
+    def test_search_subclasses(self, project, cache_dir):
+        found = importutils.search_subclasses(str(project), templates.Template)
+        assert set(template.name for template in found) == set(['first', 'second'])
+        # the cache is written out of the scanned project
+        assert len(cache_dir.listdir()) == 1
+        assert cache_dir.listdir()[0].strpath == importutils.get_cache_path(str(project))
+        assert not project.join('__pycache__').check()
+
+    def test_scan_cache(self, project, monkeypatch):
+        importutils.scan_files(str(project), ['discovery_templates.py', 'discovery_other.py'])
+        scanned = []
+        scan_source = importutils.scan_source
+        monkeypatch.setattr(importutils, 'scan_source',
+                            lambda source: scanned.append(source) or scan_source(source))
+
+        importutils.scan_files(str(project), ['discovery_templates.py', 'discovery_other.py'])
+        assert scanned == []
+
+        project.join('discovery_other.py').write('class Other(object):\n    pass\n')
+        scans = importutils.scan_files(str(project),
+                                       ['discovery_templates.py', 'discovery_other.py'])
+        assert len(scanned) == 1
+        assert scans['discovery_other.py'] == ([('Other', set(['object']), set())], {},
+                                               set(['object']), set(), False)
+
+    def test_search_subclasses_external_base(self, tmpdir, monkeypatch):
+        tmpdir.join('discovery_extlib.py').write(
+            'from elastic_mapper.templates import Template\n'
+            'class BaseTemplate(Template):\n'
+            '    name = "base"\n')
+        project = tmpdir.mkdir('discovery_project')
+        project.join('__init__.py').write('')
+        project.join('discovery_external.py').write(
+            'from discovery_extlib import BaseTemplate\n'
+            'class MyTemplate(BaseTemplate):\n'
+            '    name = "mine"\n')
+        monkeypatch.syspath_prepend(str(tmpdir))
+
+        found = importutils.search_subclasses(str(project), templates.Template)
+        names = set(template.__name__ for template in found)
+        assert names == set(['BaseTemplate', 'MyTemplate'])
+
+    def test_find_candidates_packages(self, project):
+        project.join('discovery_main.py').write('from app.mappings import AppMapper\n')
+        project.join('discovery_dynamic.py').write('from discovery_helpers import *\n')
+        scans = importutils.scan_files(str(project), [
+            'discovery_main.py', 'discovery_dynamic.py', 'discovery_other.py'])
+        assert importutils.find_candidates(scans, ['Template']) == ['discovery_dynamic.py']
+        assert importutils.find_candidates(scans, ['Template'], ['app']) == [
+            'discovery_dynamic.py', 'discovery_main.py']
+
+    def test_search_subclasses_sample_project(self, monkeypatch):
+        src = os.path.join(os.path.dirname(__file__), 'test_integration',
+                           'test-project-elastic-mapper', 'src')
+        monkeypatch.syspath_prepend(src)
+        found = importutils.search_subclasses(src, templates.Template)
+        assert set(template.name for template in found) == set([
+            'test_template_app1', 'test_template_app2'])
+        assert set(typename for template in found for typename in template.types) == set([
+            'test_type_app1', 'test_type_app2', 'test_type_app3'])
+
+
+class TestClusterSnapshot(object):
+
+    def test_json_stream_invalid_json_bounded(self):
+        read = []
+
+        def chunks():
+            yield '{"index": {"mappings": '
+            while True:
+                read.append(1)
+                yield '[1, 2, }' * 100
+
+        items = snapshots.JSONObjectStream(chunks(), max_value_size=10000).items()
+        with pytest.raises(ValueError):
+            list(items)
+        assert len(read) < 100
+
+    def test_fetch_without_streaming_connection(self):
+        mappings = {'index-1': {'mappings': {'test_type': {'properties': {
+            'test_attr': {'type': 'string'}}}}}}
+
+        class Indices(object):
+            def get_mapping(self):
+                return mappings
+
+            def get_template(self):
+                return {}
+
+        class Client(object):
+            indices = Indices()
+
+        cluster = snapshots.ClusterSnapshot.fetch(Client())
+        assert cluster.mappings == mappings
+
 
 class TestExporter(object):
 
@@ -220,6 +797,488 @@ class TestExporter(object):
         assert exported == test_args
 
 
+class CollectingExportBackend(exporters.ExportBackend):
+    "Backend collecting the data of the exported documents in `exported`"
+    consumes = exporters.DATA
+
+    def __init__(self):
+        self.exported = []
+
+    def export(self, mapper):
+        self.exported.append(mapper.mapped_data)
+
+    def export_envelope(self, envelope):
+        self.exported.append(envelope.data)
+
+
+@pytest.fixture
+def export_backends():
+    "The `Config`, with its export backends reset during the test and restored afterwards"
+    conf = config.Config()
+    previous_backends = conf.export_backends
+    conf.reset_export_backends()
+    yield conf
+    conf.export_backends = previous_backends
+
+
+@pytest.fixture
+def exported(export_backends):
+    "List of the documents exported during the test, collected by a `CollectingExportBackend`"
+    export_backends.add_export_backend(CollectingExportBackend)
+    return export_backends.export_backends[-1].exported
+
+
+class TestExportEnvelope(object):
+
+    def test_mapped_once_for_all_backends(self, export_backends):
+        calls = []
+
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField(method='get_test_attr')
+
+            def get_test_attr(self, obj):
+                calls.append(obj)
+                return 'test value'
+
+        class LegacyExportBackend(exporters.ExportBackend):
+            exported = []
+
+            def export(self, mapper):
+                self.exported.append(mapper.mapped_data)
+
+        class JSONExportBackend(exporters.ExportBackend):
+            consumes = exporters.JSON
+            exported = []
+
+            def export(self, mapper):
+                pass
+
+            def export_envelope(self, envelope):
+                self.exported.append(envelope.get(self.consumes))
+
+        export_backends.add_export_backend(LegacyExportBackend)
+        export_backends.add_export_backend(LegacyExportBackend)
+        export_backends.add_export_backend(JSONExportBackend)
+        mapper = TestMapper({})
+        mapper.export()
+
+        assert len(calls) == 1
+        assert LegacyExportBackend.exported == [{'test_attr': 'test value'}] * 2
+        assert JSONExportBackend.exported == ['{"test_attr": "test value"}']
+        # the cached document is only served during the export
+        mapper.mapped_data
+        assert len(calls) == 2
+
+    def test_encoded_forms(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        envelope = exporters.ExportEnvelope(TestMapper({'test_attr': '\u00e9'}))
+        assert envelope.data == {'test_attr': '\u00e9'}
+        assert envelope.json_bytes == envelope.json.encode('utf-8')
+        assert envelope.get(exporters.JSON) is envelope.json
+
+
+class StubBulkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Fake `_bulk` endpoint rejecting the documents with a `reject` attribute."""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        lines = body.splitlines()
+        self.requests.append(lines)
+        items = []
+        for action, doc in zip(lines[::2], lines[1::2]):
+            info = dict(json.loads(action)['index'], status=201)
+            if 'reject' in json.loads(doc):
+                info.update(status=400, error={'type': 'mapper_parsing_exception'})
+            items.append({'index': info})
+
+        response = json.dumps({'errors': False, 'items': items}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ClosingBulkHandler(StubBulkHandler):
+    """Fake `_bulk` endpoint closing the kept-alive connection after answering."""
+
+    def do_POST(self):
+        StubBulkHandler.do_POST(self)
+        self.close_connection = True
+
+
+class UnansweredBulkHandler(StubBulkHandler):
+    """Fake `_bulk` endpoint closing the connection without answering."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.requests.append(body.splitlines())
+        self.close_connection = True
+
+
+class TestBulkExportBackend(object):
+
+    def setup_method(self, method):
+        templates.Template.types = dict()
+
+    def serve(self, handler):
+        server = StubServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+        return server
+
+    @pytest.fixture
+    def stub_server(self):
+        StubBulkHandler.requests = []
+        server = self.serve(StubBulkHandler)
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture
+    def mapper_cls(self):
+        class TestTemplate(templates.Template):
+            name = "test_template"
+            index = "test-bulk-{time}"
+            parser = parsers.YearlyParser()
+
+        @templates.register('test_type', TestTemplate)
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+            class Meta:
+                dynamic_fields = '__all__'
+
+        return TestMapper
+
+    def test_flush_by_count(self, stub_server, mapper_cls):
+        backend = exporters.BulkExportBackend(port=stub_server.server_port, max_docs=2,
+                                              max_latency=None)
+        for i in range(3):
+            backend.export(mapper_cls({'test_attr': i}))
+
+        assert len(StubBulkHandler.requests) == 1
+        action, doc = StubBulkHandler.requests[0][:2]
+        action = json.loads(action)['index']
+        assert action['_index'].startswith('test-bulk-')
+        assert action['_type'] == 'test_type'
+        assert json.loads(doc) == {'test_attr': '0'}
+
+        result = backend.flush()
+        assert result.indexed == 1
+        assert len(StubBulkHandler.requests) == 2
+        backend.close()
+
+    def test_item_failures(self, stub_server, mapper_cls):
+        failures = []
+        backend = exporters.BulkExportBackend(port=stub_server.server_port, max_latency=None,
+                                              on_failure=failures.append)
+        backend.export(mapper_cls({'test_attr': 'ok'}))
+        backend.export(mapper_cls({'test_attr': 'ko', 'reject': True}))
+
+        result = backend.flush()
+        assert result.indexed == 1
+        assert failures == result.failures
+        assert failures[0].status == 400
+        assert failures[0].error['type'] == 'mapper_parsing_exception'
+        backend.close()
+
+    def test_dropped_connection_reopened(self, mapper_cls):
+        StubBulkHandler.requests = []
+        server = self.serve(ClosingBulkHandler)
+        try:
+            backend = exporters.BulkExportBackend(port=server.server_port, max_docs=1,
+                                                  max_latency=None)
+            for i in range(3):
+                backend.export(mapper_cls({'test_attr': i}))
+                # idle until the server closed the connection
+                time.sleep(0.05)
+            backend.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert len(StubBulkHandler.requests) == 3
+
+    def test_failed_request_not_retried(self, mapper_cls):
+        StubBulkHandler.requests = []
+        failures = []
+        server = self.serve(UnansweredBulkHandler)
+        try:
+            backend = exporters.BulkExportBackend(port=server.server_port, max_latency=None,
+                                                  on_failure=failures.append)
+            backend.export(mapper_cls({'test_attr': 0}))
+            backend.export(mapper_cls({'test_attr': 1}))
+            with pytest.raises(http_client.HTTPException):
+                backend.flush()
+            backend.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        # the batch may have been indexed, so it is reported instead of sent again
+        assert len(StubBulkHandler.requests) == 1
+        assert [failure.typename for failure in failures] == ['test_type', 'test_type']
+        assert failures[0].status is None
+
+    def test_flush_by_latency(self, stub_server, mapper_cls):
+        backend = exporters.BulkExportBackend(port=stub_server.server_port, max_latency=0.05)
+        backend.export(mapper_cls({'test_attr': 'value'}))
+        for _ in range(100):
+            if StubBulkHandler.requests:
+                break
+            time.sleep(0.01)
+        assert len(StubBulkHandler.requests) == 1
+        backend.close()
+
+    def test_async_export(self, stub_server, mapper_cls, export_backends):
+        asyncio = pytest.importorskip('asyncio')
+        from elastic_mapper import async_exporters
+
+        conf = export_backends
+        conf.add_async_export_backend(async_exporters.AsyncBulkExportBackend,
+                                      port=stub_server.server_port, max_docs=2,
+                                      max_latency=None)
+        backend = conf.async_export_backends[0]
+        loop = asyncio.new_event_loop()
+        try:
+            for i in range(3):
+                loop.run_until_complete(TrackingService.aexport_test_type({'test_attr': i}))
+            result = loop.run_until_complete(backend.flush())
+            loop.run_until_complete(backend.aclose())
+        finally:
+            loop.close()
+            conf.reset_async_export_backends()
+
+        documents = [json.loads(doc) for request in StubBulkHandler.requests
+                     for doc in request[1::2]]
+        assert sorted(doc['test_attr'] for doc in documents) == ['0', '1', '2']
+        assert len(StubBulkHandler.requests) == 2
+        assert result.failures == []
+
+    def run_async_export(self, handler, mapper_cls, documents, **kwargs):
+        asyncio = pytest.importorskip('asyncio')
+        from elastic_mapper import async_exporters
+
+        StubBulkHandler.requests = []
+        server = self.serve(handler)
+        backend = async_exporters.AsyncBulkExportBackend(port=server.server_port,
+                                                         max_latency=None, **kwargs)
+        loop = asyncio.new_event_loop()
+        try:
+            for document in documents:
+                loop.run_until_complete(backend.export(mapper_cls(document)))
+                loop.run_until_complete(backend.flush())
+                # idle until the server closed the connection
+                time.sleep(0.05)
+            loop.run_until_complete(backend.aclose())
+        finally:
+            loop.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_async_dropped_connection_reopened(self, mapper_cls):
+        documents = [{'test_attr': i} for i in range(3)]
+        self.run_async_export(ClosingBulkHandler, mapper_cls, documents, max_docs=1)
+        assert len(StubBulkHandler.requests) == 3
+
+    def test_async_failed_request_not_retried(self, mapper_cls):
+        failures = []
+        self.run_async_export(UnansweredBulkHandler, mapper_cls, [{'test_attr': 0}],
+                              on_failure=failures.append)
+        # the batch may have been indexed, so it is reported instead of sent again
+        assert len(StubBulkHandler.requests) == 1
+        assert [failure.typename for failure in failures] == ['test_type']
+
+    def test_async_export_sync_backends(self, mapper_cls, export_backends):
+        asyncio = pytest.importorskip('asyncio')
+
+        class ThreadExportBackend(exporters.ExportBackend):
+            threads = []
+
+            def export(self, mapper):
+                self.threads.append(threading.current_thread())
+
+        export_backends.add_export_backend(ThreadExportBackend)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(TrackingService.aexport_test_type({'test_attr': 0}))
+        finally:
+            loop.close()
+
+        # sync backends do not block the event loop thread
+        assert len(ThreadExportBackend.threads) == 1
+        assert ThreadExportBackend.threads[0] is not threading.current_thread()
+
+
+class TestAsyncDispatcher(object):
+
+    @pytest.fixture
+    def blocking_backend(self, export_backends):
+        class BlockingExportBackend(exporters.ExportBackend):
+            released = threading.Event()
+            exported = []
+
+            def export(self, mapper):
+                self.released.wait(5)
+                self.exported.append(mapper.mapped_data)
+
+        export_backends.add_export_backend(BlockingExportBackend)
+        yield BlockingExportBackend
+        BlockingExportBackend.released.set()
+        export_backends.set_dispatch_mode('sync')
+
+    @pytest.fixture
+    def mapper_cls(self):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField()
+
+        return TestMapper
+
+    def test_async_flush(self, blocking_backend, mapper_cls):
+        conf = config.Config()
+        conf.set_dispatch_mode('async', queue_size=10)
+        for i in range(3):
+            mapper_cls({'test_attr': i}).export()
+        assert not conf.dispatcher.flush(timeout=0.01)
+
+        blocking_backend.released.set()
+        assert conf.dispatcher.flush(timeout=5)
+        assert blocking_backend.exported == [{'test_attr': i} for i in range(3)]
+
+    def test_async_drop_newest(self, blocking_backend, mapper_cls):
+        conf = config.Config()
+        conf.set_dispatch_mode('async', queue_size=1, overflow='drop_newest')
+        for i in range(5):
+            mapper_cls({'test_attr': i}).export()
+
+        blocking_backend.released.set()
+        conf.dispatcher.flush(timeout=5)
+        # one mapper being exported, one queued and the rest dropped
+        assert conf.dispatcher.dropped >= 3
+        assert blocking_backend.exported[0] == {'test_attr': 0}
+        assert len(blocking_backend.exported) + conf.dispatcher.dropped == 5
+
+    def test_async_drop_oldest(self, blocking_backend, mapper_cls):
+        conf = config.Config()
+        conf.set_dispatch_mode('async', queue_size=1, overflow='drop_oldest')
+        for i in range(5):
+            mapper_cls({'test_attr': i}).export()
+
+        blocking_backend.released.set()
+        conf.dispatcher.flush(timeout=5)
+        assert blocking_backend.exported[-1] == {'test_attr': 4}
+        assert len(blocking_backend.exported) + conf.dispatcher.dropped == 5
+
+    def test_async_drop_oldest_keeps_stop_sentinels(self, mapper_cls, exported):
+        # a full queue holding the stop sentinel of a closing dispatcher
+        dispatcher = dispatchers.AsyncDispatcher(config.Config(), queue_size=1, workers=0,
+                                                 overflow='drop_oldest')
+        dispatcher.queue.put(dispatchers._STOP)
+        dispatcher.dispatch(mapper_cls({'test_attr': 1}))
+
+        # the mapper is exported inline and the sentinel is kept for the workers
+        assert exported == [{'test_attr': 1}]
+        assert dispatcher.queue.get_nowait() is dispatchers._STOP
+        assert dispatcher.dropped == 0
+
+    def test_invalid_overflow_policy(self):
+        with pytest.raises(AssertionError) as excinfo:
+            config.Config().set_dispatch_mode('async', overflow='invalid')
+        assert 'should be one of' in str(excinfo.value)
+
+
+class TestSampler(object):
+
+    def test_sample_key(self, exported):
+        class TestMapper(mappers.Mapper):
+            user = mappers.IntegerField()
+
+            class Meta:
+                sample_rate = 0.5
+                sample_key = 'user'
+
+        for _ in range(2):
+            for user in range(100):
+                TestMapper({'user': user}).export()
+
+        users = [doc['user'] for doc in exported]
+        # the same users are exported every time
+        assert users[:len(users) // 2] == users[len(users) // 2:]
+        assert 30 < len(users) // 2 < 70
+        sampler = TestMapper._meta.sampler
+        assert sampler.dropped[samplers.SAMPLED] == 200 - len(users)
+
+    def test_sample_rate(self):
+        sampler = samplers.Sampler(sample_rate=0.1)
+        allowed = sum(sampler.allow({}) for _ in range(10000))
+        assert 800 < allowed < 1200
+        assert sampler.dropped == {samplers.SAMPLED: 10000 - allowed, samplers.RATE_LIMITED: 0}
+        assert samplers.Sampler(sample_rate=0).allow({}) is False
+
+    def test_rate_limit(self, monkeypatch, exported):
+        now = [1000.0]
+        monkeypatch.setattr(samplers, '_clock', lambda: now[0])
+
+        @templates.register('test_limited_type', templates.Template, rate_limit=10,
+                            rate_limit_burst=5)
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField()
+
+        assert TestMapper.export_many({'test_attr': i} for i in range(20)) == 5
+        now[0] += 0.5
+        assert TestMapper.export_many({'test_attr': i} for i in range(20)) == 5
+        TrackingService.export_test_limited_type({'test_attr': 0})
+        assert len(exported) == 10
+        assert samplers.get_dropped_events()['test_limited_type'] == {
+            samplers.SAMPLED: 0,
+            samplers.RATE_LIMITED: 31,
+        }
+
+    def test_register_overrides_meta_options(self):
+        @templates.register('test_sampled_type', templates.Template, sample_rate=0.5)
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField()
+
+            class Meta:
+                sample_rate = 0.1
+                rate_limit = 10
+
+        sampler = TestMapper._meta.sampler
+        assert sampler.sample_rate == 0.5
+        assert sampler.bucket is not None and sampler.bucket.rate == 10
+
+    def test_dropped_events_not_mapped(self, exported):
+        class TestMapper(mappers.Mapper):
+            test_attr = mappers.IntegerField(method='get_test_attr')
+
+            class Meta:
+                sample_rate = 0
+
+            def get_test_attr(self, obj):
+                raise AssertionError('dropped events should not be mapped')
+
+        TestMapper({}).export()
+        assert exported == []
+
+    def test_invalid_options(self):
+        with pytest.raises(AssertionError) as excinfo:
+            samplers.Sampler(sample_rate=2)
+        assert 'between 0 and 1' in str(excinfo.value)
+        with pytest.raises(AssertionError) as excinfo:
+            templates.register('test_type', templates.Template, sample_ratio=0.5)
+        assert 'sample_ratio' in str(excinfo.value)
+
+
 class TestService(object):
 
     @pytest.fixture
@@ -276,3 +1335,35 @@ class TestService(object):
         assert '`9_invalid_typename`' in warning_msg
         # check that the sanitized identifier is valid (no exception risen)
         TrackingService.export_9_invalid_typename(test_args)
+
+    def test_service_cached_entry_points(self, mapper_args):
+        TrackingService.export_test_type(mapper_args)
+        entry_point = TrackingService.__dict__['export_test_type']
+        TrackingService.export_test_type(mapper_args)
+        assert TrackingService.__dict__['export_test_type'] is entry_point
+
+        # registering the typename again clears the cached entry point
+        @templates.register('test_type', templates.Template)
+        class OtherMapper(mappers.Mapper):
+            other_attr = mappers.StringField()
+
+        assert 'export_test_type' not in TrackingService.__dict__
+
+    def test_service_export_many(self, mapper_args, exported):
+        documents = [{'test_attr': i} for i in range(5)]
+        assert TrackingService.export_many_test_type(documents) == 5
+        assert TrackingService.export_stream_test_type(iter(documents), chunk_size=2) == 5
+
+        expected = [{'test_attr': '%d' % i} for i in range(5)]
+        assert exported == expected * 2
+
+    def test_service_export_prefix_typename(self):
+        @templates.register('many_type', templates.Template)
+        class ManyMapper(mappers.Mapper):
+            test_attr = mappers.StringField()
+
+        # `export_many_type` is the single export of the `many_type` type
+        TrackingService.export_many_type({'test_attr': 'value'})
+        with pytest.raises(AttributeError) as excinfo:
+            TrackingService.export_many_unknown([])
+        assert '`unknown`' in str(excinfo.value)